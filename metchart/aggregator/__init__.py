@@ -4,18 +4,24 @@ Aggregator
 from __future__ import annotations
 
 from enum import StrEnum, auto
-from typing import Iterable
-import xarray as xr
+from typing import Iterable, TYPE_CHECKING
 import datetime
 
 import itertools
 import numpy as np
 from .. import misc
+from .. import timing
 
 import logging
 logger = logging.getLogger(__name__)
 
 import os
+import hashlib
+import threading
+
+# NOTE xarray takes long to import, it is only loaded once data is aggregated or plotted
+if TYPE_CHECKING:
+    import xarray as xr
 
 def _sanitize_value_string(v) -> str:
     if type(v) is datetime.datetime:
@@ -26,6 +32,181 @@ def _sanitize_value_string(v) -> str:
         return '{:.2f}'.format(v)
     return str(v)
 
+def dask_chunks(chunks: bool | dict | None) -> dict | None:
+    '''
+    Translates the 'chunks' option of an aggregator into the argument of xr.open_dataset.
+    True uses the chunks of the file, a dict maps dimensions in the file to chunk sizes.
+    '''
+    if chunks is None or chunks is False:
+        return None
+
+    import importlib.util
+    if importlib.util.find_spec('dask') is None:
+        raise AggregatorException("'chunks' needs dask, install metchart[dask]")
+
+    return {} if chunks is True else dict(chunks)
+
+def crop(ds: xr.Dataset, area: tuple | None) -> xr.Dataset:
+    '''
+    Selects area (west, east, south, north) from a dataset on a regular lat/lon grid.
+    Datasets without latitude and longitude dimensions are returned as they are.
+    '''
+    if area is None or Dimension.LATITUDE not in ds.dims or Dimension.LONGITUDE not in ds.dims:
+        return ds
+
+    west, east, south, north = area
+    lat = ds[Dimension.LATITUDE].values
+    # NOTE GRIB files often scan from north to south
+    lat_slice = slice(south, north) if lat[0] <= lat[-1] else slice(north, south)
+    return ds.sel({Dimension.LATITUDE: lat_slice, Dimension.LONGITUDE: slice(west, east)})
+
+def _unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+class SpatialIndex:
+    '''
+    Finds the grid points nearest to latitude/longitude pairs.
+    Regular grids are searched per axis, like Dataset.sel(method='nearest'),
+    others (e.g. stations) with a k-d tree on the unit sphere.
+    '''
+    def __init__(self, latitude: xr.DataArray, longitude: xr.DataArray):
+        self._regular = latitude.dims == (Dimension.LATITUDE,) and longitude.dims == (Dimension.LONGITUDE,)
+        if self._regular:
+            import pandas as pd
+            self._dims = (Dimension.LATITUDE, Dimension.LONGITUDE)
+            self._axes = (pd.Index(latitude.values), pd.Index(longitude.values))
+            return
+
+        from scipy.spatial import cKDTree
+        import xarray as xr
+        latitude, longitude = xr.broadcast(latitude, longitude)
+        self._dims = latitude.dims
+        self._shape = latitude.shape
+        self._points = np.stack([latitude.values.ravel(), longitude.values.ravel()], axis=-1)
+        self._tree = cKDTree(_unit_vectors(self._points[:, 0], self._points[:, 1]))
+
+    def lookup(self, latitude, longitude, method: str | None = 'nearest') -> dict:
+        '''
+        Positions of the grid points nearest to the given points, per grid dimension.
+        Without method only exact matches are found, KeyError is raised for missing ones.
+        '''
+        latitude = np.atleast_1d(np.asarray(latitude, dtype=float))
+        longitude = np.atleast_1d(np.asarray(longitude, dtype=float))
+
+        if self._regular:
+            positions = [axis.get_indexer(values, method=method) for axis, values in zip(self._axes, (latitude, longitude))]
+            missing = (positions[0] < 0) | (positions[1] < 0)
+        else:
+            _, flat = self._tree.query(_unit_vectors(latitude, longitude))
+            positions = np.unravel_index(flat, self._shape)
+            missing = np.zeros(len(flat), dtype=bool) if method == 'nearest' else \
+                np.any(self._points[flat] != np.stack([latitude, longitude], axis=-1), axis=-1)
+
+        if missing.any():
+            raise KeyError(f'no grid point at {latitude[missing][0]}, {longitude[missing][0]}')
+        return dict(zip(self._dims, positions))
+
+# NOTE grid -> SpatialIndex, grids are the same for every message of a model and every view of a dataset
+_index_cache = {}
+_INDEX_CACHE_SIZE = 8
+# NOTE points are extracted by aggregators running in threads
+_index_lock = threading.Lock()
+
+def spatial_index(ds: xr.Dataset) -> SpatialIndex | None:
+    '''
+    Index of the latitude and longitude coordinates of ds, None if it has none
+    '''
+    if Dimension.LATITUDE not in ds.coords or Dimension.LONGITUDE not in ds.coords:
+        return None
+
+    lat, lon = ds.coords[Dimension.LATITUDE], ds.coords[Dimension.LONGITUDE]
+    h = hashlib.sha1()
+    for c in (lat, lon):
+        h.update(str(c.dims).encode())
+        h.update(np.ascontiguousarray(c.values).tobytes())
+    key = h.hexdigest()
+
+    with _index_lock:
+        if key not in _index_cache:
+            if len(_index_cache) >= _INDEX_CACHE_SIZE:
+                _index_cache.pop(next(iter(_index_cache)))
+            _index_cache[key] = SpatialIndex(lat, lon)
+        return _index_cache[key]
+
+def extract_points(ds: xr.Dataset, points: tuple | None) -> xr.Dataset:
+    '''
+    Columns of ds at the grid points nearest to points, along a station dimension.
+    latitude and longitude of the grid points are kept as coordinates of the stations.
+    '''
+    index = None if points is None else spatial_index(ds)
+    if index is None:
+        return ds
+
+    import xarray as xr
+
+    lat, lon = np.array(points, dtype=float).T
+    return ds.isel({
+        dim: xr.DataArray(p, dims=Dimension.STATION) for dim, p in index.lookup(lat, lon).items()
+    })
+
+def _spatial_positions(ds: xr.Dataset, queries: list[dict]) -> list[tuple[dict, dict] | None]:
+    '''
+    Looks up the latitude/longitude of all queries at once.
+    Returns (positions, remaining query) per query, None where label based selection is needed.
+    '''
+    keys = (Dimension.LATITUDE, Dimension.LONGITUDE, 'method')
+    results = [None] * len(queries)
+    spatial = [
+        i for i, q in enumerate(queries)
+            if Dimension.LATITUDE in q and Dimension.LONGITUDE in q and q.get('method') in (None, 'nearest')
+                and all([k in keys or k in ds.dims or k in ds.coords for k in q])
+    ]
+    index = spatial_index(ds) if len(spatial) > 0 else None
+    if index is None:
+        return results
+
+    for method in ('nearest', None):
+        group = [i for i in spatial if queries[i].get('method') == method]
+        if len(group) < 1:
+            continue
+        try:
+            positions = index.lookup([queries[i][Dimension.LATITUDE] for i in group],
+                                     [queries[i][Dimension.LONGITUDE] for i in group], method)
+        except KeyError:
+            # NOTE raised again by the view of the missing point
+            continue
+
+        for n, i in enumerate(group):
+            rest = {k: v for k, v in queries[i].items() if k not in keys}
+            if len(rest) > 0 and method is not None:
+                rest['method'] = method
+            results[i] = ({dim: int(p[n]) for dim, p in positions.items()}, rest)
+
+    return results
+
+def area_contains(area: tuple, inner: tuple) -> bool:
+    west, east, south, north = area
+    i_west, i_east, i_south, i_north = inner
+    return west <= i_west and i_east <= east and south <= i_south and i_north <= north
+
+def area_contains_point(area: tuple, latitude: float, longitude: float) -> bool:
+    west, east, south, north = area
+    return west <= longitude <= east and south <= latitude <= north
+
+def parse_area(area) -> tuple | None:
+    '''
+    area from the config, [west, east, south, north] in degrees
+    '''
+    if area is None:
+        return None
+    if len(area) != 4:
+        raise AggregatorException(f'area has to be [west, east, south, north], got {area}')
+    west, east, south, north = [float(a) for a in area]
+    if west >= east or south >= north:
+        raise AggregatorException(f'area {area} is empty')
+    return west, east, south, north
+
 class AggregatorException(Exception):
     pass
 
@@ -77,6 +258,10 @@ class Aggregator():
         self._name = name
         # WARNING This is hacky. we need a clear interface for directly accessing the dataset
         self._dataset = None
+        # NOTE (west, east, south, north) the data is cropped to, None for all of it
+        self._area = None
+        # NOTE (latitude, longitude) of the queried points, None unless only those are extracted
+        self._points = None
         self._init()
 
         self._provides_dynamic = []
@@ -91,10 +276,77 @@ class Aggregator():
         if var not in self._needed_variables:
             self._needed_variables.append(var)
 
+    def plan(self) -> dict:
+        '''
+        Describes what aggregate() would do, without downloading or loading data.
+        Returns a dict with
+          files: list of dicts with 'source', 'destination', 'bytes' (estimated) and 'cached'
+          dataset: xr.Dataset holding only the coordinates to expect
+        '''
+        return self._plan()
+
     def aggregate(self) -> None:
-        self._aggregate()
+        with timing.stage('aggregate', aggregator=self._name) as t:
+            self._aggregate()
+            if self._dataset is not None:
+                t['bytes'] = self._dataset.nbytes
         logger.debug(f"{self._name}: aggregation complete")
 
+    def fingerprint(self) -> str | None:
+        '''
+        Identifies the currently aggregated data, e.g. by model run.
+        None if the aggregator can not tell.
+        '''
+        return self._fingerprint()
+
+    def area(self) -> tuple | None:
+        '''
+        (west, east, south, north) the data is limited to, None if not limited
+        '''
+        return self._area
+
+    def extracts_points(self) -> bool:
+        '''
+        True if only the columns at the points added with add_point() are aggregated
+        '''
+        return self._points is not None
+
+    def add_point(self, latitude: float, longitude: float) -> None:
+        if self._points is None:
+            return
+        point = (float(latitude), float(longitude))
+        if point not in self._points:
+            self._points.append(point)
+
+    def poll(self) -> str | None:
+        '''
+        Identifies the newest data available at the source, without downloading it.
+        A changed value means aggregate() would yield new data.
+        None if the aggregator can not tell, it is aggregated every time then.
+        '''
+        return self._poll()
+
+    def run_of(self, filename: str) -> str | None:
+        '''
+        Model run a file in the cache directory of this aggregator belongs to.
+        Used to evict whole runs from the cache. None if unknown.
+        '''
+        return self._run_of(filename)
+
+    def runs_in_use(self) -> list[str]:
+        '''
+        Runs, as returned by run_of(), this aggregator holds or is about to aggregate.
+        Their files are never evicted from the cache.
+        '''
+        return self._runs_in_use()
+
+    def cache_directory(self) -> str:
+        '''
+        Name of the directory in the cache this aggregator keeps its downloads in.
+        Aggregators of the same data source may share it.
+        '''
+        return self._cache_directory()
+
     def query_data(self, var: Variable, query: list[tuple[Variable,object]]) -> xr.DataArray:
         return self._query_data(var,query)
 
@@ -111,6 +363,24 @@ class Aggregator():
     def _aggregate(self) -> None:
         raise AggregatorNotImplementedException('_aggregate() not implemented')
 
+    def _fingerprint(self) -> str | None:
+        return None
+
+    def _poll(self) -> str | None:
+        return None
+
+    def _run_of(self, filename: str) -> str | None:
+        return None
+
+    def _runs_in_use(self) -> list[str]:
+        return []
+
+    def _cache_directory(self) -> str:
+        return self._name
+
+    def _plan(self) -> dict:
+        raise AggregatorNotImplementedException('_plan() not implemented')
+
     # NOTE Deprecated
     def _query_data(self, var: Variable, query: list[tuple[Variable,object]]) -> xr.DataArray:
         raise AggregatorNotImplementedException('_query_data() not implemented')
@@ -131,17 +401,69 @@ class DataView():
         self.long_name = long_name
         self.parent = parent
 
+        # NOTE memoized, children select from it without selecting this view again
+        self._selection = None
+        # NOTE (positions, remaining query) if the query selects by position,
+        # see _spatial_positions() and along_dimensions()
+        self._positions = None
+
     def get(self) -> xr.Dataset:
+        if self._selection is None:
+            self._selection = self._select()
+        return self._selection
+
+    def _select(self) -> xr.Dataset:
         if self.query is not None:
-            return self._dataset.sel(** self.query)
+            source = self._source()
+            positions = self._positions
+            if positions is None:
+                positions = _spatial_positions(source, [self.query])[0]
+            if positions is not None:
+                selection = source.isel(positions[0])
+                return selection.sel(** positions[1]) if len(positions[1]) > 0 else selection
+            return source.sel(** self.query)
+        return self._source()
+
+    def _source(self) -> xr.Dataset:
+        '''
+        Dataset this view selects from. Views without own dataset select from their parent.
+        '''
+        if self._dataset is None and self.parent is not None:
+            return self.parent.get()
         return self._dataset
 
     def for_queries(self, queries: list[dict]) -> Iterable[DataView]:
         if len(queries) < 1:
             yield self
-
-        for query in queries:
-            yield DataView(self.get(), parent=self, **query)
+            return
+
+        # NOTE all points are looked up at once, the views select by position
+        positions = _spatial_positions(self.get(), [query.get('query', {}) for query in queries])
+        for query, p in zip(queries, positions):
+            view = DataView(None, parent=self, **query)
+            view._positions = p
+            yield view
+
+    def detach(self) -> DataView:
+        '''
+        Returns a copy of this view that only holds its own selection.
+        Parents are kept for naming, but without data, so the view is cheap to
+        send to a worker process.
+        '''
+        parent = None
+        if self.parent is not None:
+            parent = self.parent._detach_chain()
+
+        view = DataView(None, query=self.query, name=self.name, long_name=self.long_name, parent=parent)
+        view._selection = self.get()
+        return view
+
+    def _detach_chain(self) -> DataView:
+        parent = None
+        if self.parent is not None:
+            parent = self.parent._detach_chain()
+
+        return DataView(None, query=self.query, name=self.name, long_name=self.long_name, parent=parent)
 
     def _get_attr_from_parents(self, attr: str) -> Iterable:
         ptr = self
@@ -201,21 +523,50 @@ class DataView():
     def along_dimensions(self, dimensions: list[Dimension]) -> Iterable[DataView]:
         if len(dimensions) < 1:
             yield self
+            return
+
+        # NOTE only the coordinates are read, the selection of this view is left to the children
+        source = self._source()
+        dims = self._positional_dims(source, dimensions)
 
         for query_parts in itertools.product(*[
-                                        [{d:s} for s in self._dataset[d].values]
+                                        [(d, i, s) for i, s in enumerate(source[d].values)]
                                         for d in dimensions
                                      ]):
             if len(query_parts) < 1:
                 # NOTE this is needed, because product() does not return an empty iterable if input is empty...
                 break
 
-            query = {}
-            for p in query_parts:
-                query.update(p)
+            # NOTE the query names the view, the data is selected by position if possible
+            query = {d: s for d, _, s in query_parts}
 
             # TODO do we want to set the name here?
             # name      = '_'.join([f'{k}-{_sanitize_value_string(v)}' for k,v in query.items()])
             # long_name = ' '.join([f'{k}={_sanitize_value_string(v)}' for k,v in query.items()])
 
-            yield DataView(self.get(), query=query, parent=self)
+            view = DataView(None, query=query, parent=self)
+            if dims is not None:
+                view._positions = ({dim: i for dim, (_, i, _) in zip(dims, query_parts)}, {})
+            yield view
+
+    def _positional_dims(self, source: xr.Dataset, dimensions: list[Dimension]) -> list | None:
+        '''
+        Dimension of each coordinate in dimensions, if positions in source are positions in the
+        selection of this view as well. None if the children have to select by label.
+        '''
+        # NOTE coordinates like time are indexed on another dimension (step)
+        dims = [source[d].dims[0] if source[d].ndim == 1 else None for d in dimensions]
+        if None in dims or len(set(dims)) != len(dims):
+            return None
+
+        if self.query is None:
+            selected = set()
+        elif self._positions is not None:
+            selected = set(self._positions[0])
+            for k in self._positions[1]:
+                if k != 'method':
+                    selected.update(source[k].dims if k in source.variables else [k])
+        else:
+            return None
+
+        return None if selected & set(dims) else dims
@@ -1,27 +1,33 @@
 #!/usr/bin/env python3
 
-import requests
 import datetime
-import requests
 import os
-import itertools
-
+import re
 import bz2
+import time
+import hashlib
+import itertools
+import threading
 
-from multiprocessing import cpu_count
-from multiprocessing.pool import ThreadPool
+from multiprocessing import cpu_count, get_context
 
 import xarray as xr
+import numpy as np
 
 import logging
 logger = logging.getLogger(__name__)
 
 from .. import misc
-from ..aggregator import Aggregator, Variable, Dimension
+from .. import timing
+from .. import download
+from .. import cache
+from ..aggregator import Aggregator, AggregatorException, Variable, Dimension, dask_chunks, crop, parse_area, extract_points
 
 from typing import Literal, Union
 
 BASE='https://opendata.dwd.de/weather/nwp'
+# NOTE lists every file on the server as path|size|mtime
+CONTENT_LOG=f'{BASE}/content.log.bz2'
 
 class IconAggregator(Aggregator):
     PROVIDES = [
@@ -100,32 +106,128 @@ class IconAggregator(Aggregator):
             'icon-d2': 'germany'
     }
 
+    # NOTE size of the regular lat/lon grids. Only used to estimate file sizes
+    _MODEL_GRID_POINTS = {
+            'icon': 2879 * 1441,
+            'icon-eu': 1377 * 657,
+            'icon-d2': 1215 * 746,
+    }
+    # NOTE DWD packs values with 16 bit
+    _BYTES_PER_POINT = 2
+
     def _init(self):
         self._dataset = None
         self._run = None
         self._date = None
+        # NOTE filename -> compressed size, of the last listing used
+        self._available = None
+        # NOTE steps in self._dataset and the fingerprint of the data they belong to
+        self._loaded_steps = []
+        self._loaded = None
 
     def _load_config(self, model: Literal['icon', 'icon-eu', 'icon-d2'],
                      pressure_levels: list[int], steps: list[int],
-                     description: Union[None,str] = None) -> None:
+                     description: Union[None,str] = None,
+                     run: Union[None,str] = None,
+                     download_concurrency: int = download.DEFAULT_CONCURRENCY,
+                     download_retries: int = download.DEFAULT_RETRIES,
+                     download_timeout: float = download.DEFAULT_TIMEOUT,
+                     download_revalidate: bool = False,
+                     listing: Union[None,str] = CONTENT_LOG,
+                     listing_ttl: float = 300,
+                     store: bool = True,
+                     decode_workers: int = cpu_count(),
+                     chunks: Union[None,bool,dict] = None,
+                     area: Union[None,list[float]] = None,
+                     points: bool = False,
+                     incremental: bool = False,
+                     dtype: str = 'float32',
+                     pack: Union[bool,dict] = False) -> None:
         self._description = description
+        # NOTE YYYYMMDDHH. If set, this run is used instead of the latest one
+        self._pinned_run = None if run is None else str(run)
         self._model = model
         self._levels = pressure_levels
         self._steps = steps
-
-        self._download_dir = os.path.join(self._cache_dir, self._name)
+        self._downloader = download.Downloader(download_concurrency, download_retries, download_timeout,
+                                               revalidate=download_revalidate)
+        # NOTE URL or local path of the content listing. None falls back to guessing the run by the clock
+        self._listing = listing
+        self._listing_ttl = listing_ttl
+        # NOTE keep the aggregated data of a run as NetCDF, so the GRIB files are decoded only once
+        self._store = store
+        self._decode_workers = max(int(decode_workers), 1)
+        # NOTE lazy dask arrays read from the store, see dask_chunks()
+        self._chunks = dask_chunks(chunks)
+        # NOTE [west, east, south, north], every field is cropped right after decoding
+        self._area = parse_area(area)
+        # NOTE only the columns at the for_queries points of the plotters are kept, see extract_points()
+        self._points = [] if points else None
+        # NOTE aggregate the steps published so far and add later ones as they appear
+        self._incremental = incremental
+        # NOTE of all fields in memory, float32 is plenty for plotting
+        self._dtype = np.dtype(dtype)
+        # NOTE int16 with scale and offset in the store. True for all fields, or {variable: precision}
+        self._pack = pack
+        if pack and not store:
+            logger.warning(f"{self._name}: pack only applies to the store")
+        if self._chunks is not None and not store:
+            logger.warning(f"{self._name}: chunks only apply to the store, data is kept in memory")
+
+        # NOTE shared by all aggregators of the model, filenames identify run, variable, step and level
+        self._download_dir = os.path.join(self._cache_dir, self._cache_directory())
         misc.create_output_dir(self._download_dir)
 
         self._caps_in_filename = False if model == 'icon-d2' else True
 
     def _aggregate(self) -> None:
-        self._run, self._date = get_current_run()
-        filelist = self._list_needed_files()
-
-        logger.debug(f"Getting data for {self._date} - {self._run}")
-
-        for _ in ThreadPool(cpu_count()).map(download_url, filelist):
-            pass
+        self._select_run()
+        selected = self._selected_fingerprint()
+
+        store = self._store_path()
+        if self._store and os.path.exists(store):
+            logger.debug(f"Opening stored {self._date} - {self._run}")
+            self._dataset = _open_store(store, self._chunks)
+            self._loaded_steps, self._loaded = list(self._steps), selected
+            cache.touch(store)
+            return
+
+        # NOTE steps are only added to data of the same run, variables and levels.
+        # The held data and its fingerprint are only replaced once the new data is complete.
+        loaded_steps = self._loaded_steps if self._incremental and self._loaded == selected else []
+        steps = self._steps[len(loaded_steps):]
+        if self._incremental:
+            steps = self._published_steps(steps)
+        if len(steps) < 1:
+            if len(loaded_steps) < 1:
+                raise AggregatorException(f'{self._name}: no step of {self._date}{self._run} is published yet')
+            logger.debug(f"No new steps for {self._date} - {self._run}")
+            return
+
+        filelist = self._list_needed_files(steps)
+
+        logger.debug(f"Getting data for {self._date} - {self._run}, steps {steps}")
+
+        # NOTE other aggregators or processes may be fetching the same files
+        with cache.lock(self._download_dir, int(f'{self._date}{self._run}')):
+            self._downloader.manifest(self._download_dir).reload()
+            failed = self._downloader.download_all(filelist, decompress='bz2')
+        if len(failed) > 0 and self._incremental:
+            # NOTE steps after the first missing one are fetched again on the next run
+            missing = set([os.path.basename(dest) for _, dest, _ in failed])
+            first = min([i for i, step in enumerate(steps)
+                         if any([os.path.basename(dest) in missing for _, dest in self._list_needed_files([step])])])
+            if first > 0 or len(loaded_steps) > 0:
+                logger.warning(f"{self._name}: step {steps[first]} of {self._date}{self._run} is incomplete, "
+                               f"keeping steps {loaded_steps + steps[:first]}")
+                steps, failed = steps[:first], []
+                if len(steps) < 1:
+                    return
+        if len(failed) > 0:
+            raise AggregatorException(
+                f'{len(failed)} of {len(filelist)} files could not be downloaded: '
+                + ', '.join([os.path.basename(dest) for _, dest, _ in failed])
+            )
 
         load_defaults={
                 'drop_variables':['heightAboveGround'],
@@ -133,60 +235,300 @@ class IconAggregator(Aggregator):
         }
 
         logger.debug("data loading...")
-        # TODO bit ugly, eh?
-        ds_vars = []
+        # NOTE ordered by variable, step and level, as assembled below
+        paths = []
         for var in self._needed_variables:
-            ds_steps = []
-            for step in self._steps:
-                if self._VAR_MAPPING[var]['plev']:
-                    ds_steps.append(xr.concat(
-                            [
-                                xr.open_dataset(os.path.join(self._download_dir,f), **load_defaults)
-                                for f in [self._construct_filename(step,var,l) for l in self._levels]
-                            ],
-                            dim='isobaricInhPa'
-                        ))
-                else:
-                    ds_steps.append(
-                            xr.open_dataset(
-                                os.path.join(self._download_dir,self._construct_filename(step,var)),
-                                **load_defaults
-                            )
-                        ) # NOTE Maybe a bit hacky, but does the job
-            ds_vars.append(xr.concat(ds_steps, dim='step'))
-        self._dataset = xr.merge(ds_vars)
+            for step in steps:
+                levels = self._levels if self._VAR_MAPPING[var]['plev'] else [None]
+                paths += [os.path.join(self._download_dir, self._construct_filename(step, var, l)) for l in levels]
+        decoded = self._decode_all(paths, load_defaults)
 
+        with timing.stage('merge', aggregator=self._name) as t:
+            ds = self._assemble(decoded, steps)
+            t['bytes'] = ds.nbytes
 
         # TODO is this needed still?
         if self._description is not None:
-            self._dataset.attrs['_description'] = self._description
+            ds.attrs['_description'] = self._description
 
-        self._dataset = self._dataset.set_index(step='valid_time')
-        self._dataset = self._dataset.rename_vars(
-            { v['data']: k for k, v in self._VAR_MAPPING.items() if v['data'] in self._dataset }
+        ds = ds.set_index(step='valid_time')
+        ds = ds.rename_vars(
+            { v['data']: k for k, v in self._VAR_MAPPING.items() if v['data'] in ds }
         )
-        self._dataset = self._dataset.rename_dims(
-            { v: k for k, v in self._DIM_MAPPING.items() if v in self._dataset }
+        ds = ds.rename_dims(
+            { v: k for k, v in self._DIM_MAPPING.items() if v in ds }
         )
 
+        if len(loaded_steps) > 0:
+            with timing.stage('append', aggregator=self._name, steps=len(steps)):
+                ds = xr.concat([self._dataset, ds], dim=ds[Dimension.TIME].dims[0],
+                               data_vars='minimal', coords='minimal', compat='override', join='exact')
+        self._dataset, self._loaded, self._loaded_steps = ds, selected, loaded_steps + steps
+
+        if self._loaded_steps != list(self._steps):
+            logger.debug(f"Aggregated steps {self._loaded_steps} of {self._date} - {self._run}")
+        elif self._store:
+            _write_store(self._dataset, store, self._pack)
+            self._dataset = _open_store(store, self._chunks)
+
         logger.debug("Completed data loading")
 
-    def _list_needed_files(self) -> list:
+    def _published_steps(self, steps: list[int]) -> list[int]:
+        '''
+        Leading steps with all needed files in the content listing, all of them without listing
+        '''
+        if self._available is None:
+            return list(steps)
+
+        published = []
+        for step in steps:
+            if not all([os.path.basename(dest) in self._available for _, dest in self._list_needed_files([step])]):
+                break
+            published.append(step)
+        return published
+
+    def _plan(self) -> dict:
+        # NOTE no network, the listing is only used if it is cached already
+        self._select_run(fetch=False)
+
+        # NOTE estimate of the decompressed GRIB file, if the listing does not tell
+        size = self._MODEL_GRID_POINTS[self._model] * self._BYTES_PER_POINT
+        available = self._available or {}
+        stored = self._store and os.path.exists(self._store_path())
+        files = [
+            {
+                'source': url,
+                'destination': dest,
+                'bytes': available.get(os.path.basename(dest), size),
+                'cached': stored or self._downloader.is_complete(dest)
+            }
+            for url, dest in self._list_needed_files()
+        ]
+
+        init = np.datetime64(datetime.datetime.strptime(f'{self._date}{self._run}', '%Y%m%d%H'), 'ns')
+        # NOTE same layout as produced by _aggregate()
+        dataset = xr.Dataset(coords={
+            Dimension.TIME: ('step', [init + np.timedelta64(s, 'h') for s in self._steps]),
+            Dimension.PRESSURE: ('isobaricInhPa', np.array(self._levels, dtype=float)),
+            Dimension.INIT_TIME: init,
+        }).set_xindex(Dimension.TIME).set_xindex(Dimension.PRESSURE)
+
+        return {'files': files, 'dataset': dataset}
+
+    def _select_run(self, fetch: bool = True) -> None:
+        '''
+        Selects the run to aggregate. Without fetch only a cached listing is used.
+        '''
+        if self._pinned_run is not None:
+            self._run, self._date = self._pinned_run[8:10], self._pinned_run[:8]
+            return
+
+        if self._listing is None:
+            self._run, self._date = get_current_run()
+            self._available = None
+            return
+
+        try:
+            available = self._available_files(fetch)
+        except Exception as e:
+            logger.warning(f"{self._name}: content listing unavailable, guessing the run: {e}")
+            available = None
+        if available is None:
+            self._run, self._date = get_current_run()
+            self._available = None
+            return
+
+        latest = self._latest_complete_run(available)
+        if latest is None:
+            raise AggregatorException(f'{self._name}: no run of {self._model} with all needed files is available')
+        self._available = available
+        self._date, self._run = latest[:8], latest[8:10]
+
+    def _latest_complete_run(self, available: dict) -> str | None:
+        runs = set()
+        for f in available:
+            match = _RUN_PATTERN.search(f)
+            if match is not None:
+                runs.add(match.group(1))
+
+        # NOTE incremental runs are used as soon as their first step is complete
+        steps = self._steps[:1] if self._incremental else self._steps
+        for run in sorted(runs, reverse=True):
+            if all([os.path.basename(dest) in available for _, dest in self._list_needed_files(steps, run)]):
+                return run
+        return None
+
+    def _available_files(self, fetch: bool = True) -> dict | None:
+        '''
+        Files of the configured model in the content listing, with their compressed size.
+        None if the listing is not cached and fetch is not set.
+        '''
+        if '://' not in self._listing:
+            return _parse_listing(self._listing, self._model)
+
+        path = os.path.join(self._cache_dir, os.path.basename(self._listing))
+        with _listing_lock:
+            if not fetch:
+                return _parse_listing(path, self._model) if os.path.exists(path) else None
+            if not os.path.exists(path) or time.time() - _listing_checked.get(path, 0) > self._listing_ttl:
+                # NOTE revalidated, so an unchanged listing is not transferred again
+                _listing_downloader.download(self._listing, path)
+                _listing_downloader.manifest(self._cache_dir).save()
+                _listing_checked[path] = time.time()
+            return _parse_listing(path, self._model)
+
+    def _poll(self) -> str | None:
+        if self._pinned_run is not None and not self._incremental:
+            return self._pinned_run
+
+        # NOTE the aggregated data still belongs to the selected run
+        selected = self._run, self._date, self._available
+        try:
+            self._select_run()
+            if not self._incremental:
+                return f'{self._date}{self._run}'
+            if self._available is not None:
+                return f'{self._date}{self._run}_{len(self._published_steps(self._steps))}'
+            # NOTE without listing it is unknown which steps are published, incomplete runs are always retried
+            if self._loaded == self._selected_fingerprint() and self._loaded_steps == list(self._steps):
+                return f'{self._date}{self._run}'
+            return None
+        finally:
+            self._run, self._date, self._available = selected
+
+    def _assemble(self, decoded, steps: list[int]) -> xr.Dataset:
+        '''
+        Builds the dataset of steps from the decoded files, in the order of _aggregate().
+        Every variable is allocated once at its final shape and filled field by field,
+        the layout is the same as concatenating over levels and steps and merging.
+        '''
+        data_vars = {}
+        coords = {}
+        attrs = None
+        per_step = {'step': [None] * len(steps), 'valid_time': [None] * len(steps)}
+        per_level = [None] * len(self._levels)
+
+        for var in self._needed_variables:
+            plev = self._VAR_MAPPING[var]['plev']
+            levels = self._levels if plev else [None]
+            leading = (len(steps), len(self._levels)) if plev else (len(steps),)
+            leading_dims = ('step', 'isobaricInhPa') if plev else ('step',)
+
+            with timing.stage('load', aggregator=self._name, variable=str(var)) as t:
+                arrays = {}
+                for i in range(len(steps)):
+                    for j in range(len(levels)):
+                        ds = next(decoded)
+                        if attrs is None:
+                            attrs = ds.attrs
+                        index = (i, j) if plev else (i,)
+
+                        for name, field in ds.data_vars.items():
+                            if name not in arrays:
+                                dtype = self._dtype if np.issubdtype(field.dtype, np.floating) else field.dtype
+                                arrays[name] = (np.empty(leading + field.shape, dtype=dtype), field)
+                            arrays[name][0][index] = field.values
+
+                        for name, coord in ds.coords.items():
+                            if name in per_step:
+                                per_step[name][i] = coord
+                            elif name == 'isobaricInhPa':
+                                per_level[j] = coord
+                            elif name not in coords:
+                                coords[name] = coord.variable
+
+                for name, (array, field) in arrays.items():
+                    data_vars[name] = xr.Variable(leading_dims + field.dims, array, attrs=field.attrs)
+                    t['bytes'] += array.nbytes
+
+        for name, values in per_step.items():
+            if values[0] is not None:
+                coords[name] = xr.Variable('step', np.array([v.values for v in values]), attrs=values[0].attrs)
+        if per_level[0] is not None:
+            coords['isobaricInhPa'] = xr.Variable('isobaricInhPa', np.array([v.values for v in per_level]), attrs=per_level[0].attrs)
+
+        return xr.Dataset(data_vars, coords=coords, attrs=attrs)
+
+    def _decode_all(self, paths: list[str], kwargs: dict):
+        '''
+        Yields all GRIB files opened, in the order of paths.
+        Decoding happens in a process pool if more than one worker is configured.
+        '''
+        workers = min(self._decode_workers, len(paths))
+        if workers < 2:
+            for p in paths:
+                yield _reduce(_open_grib(p, **kwargs), self._area, self._points_key())
+            return
+
+        with timing.stage('decode', aggregator=self._name, workers=workers):
+            # NOTE spawn, aggregators run in threads which must not be forked
+            with get_context('spawn').Pool(workers) as pool:
+                # NOTE consumed while decoding continues, so only few decoded files are held at once
+                for ds, rec in pool.imap(_decode_grib, [(p, kwargs, self._area, self._points_key()) for p in paths],
+                                         chunksize=max(len(paths) // (workers * 4), 1)):
+                    timing.add(rec)
+                    yield ds
+
+    def _points_key(self) -> tuple | None:
+        return None if self._points is None else tuple(sorted(self._points))
+
+    def _store_path(self) -> str:
+        # NOTE the run is part of the name, so the store is evicted together with its GRIB files
+        key = hashlib.sha256(f'{self._selected_fingerprint()}_{self._steps}_{self._pack}'.encode()).hexdigest()[:16]
+        return os.path.join(self._download_dir, f'store_{self._date}{self._run}_{key}.nc')
+
+    def _run_of(self, filename: str) -> str | None:
+        match = _RUN_PATTERN.search(filename)
+        return None if match is None else match.group(1)
+
+    def _runs_in_use(self) -> list[str]:
+        runs = []
+        if self._run is not None:
+            runs.append(f'{self._date}{self._run}')
+        # NOTE the selected run may have failed, the held data belongs to an earlier one
+        if self._dataset is not None and Dimension.INIT_TIME in self._dataset.coords:
+            init = np.datetime_as_string(self._dataset[Dimension.INIT_TIME].values, unit='h')
+            runs.append(str(init).replace('-', '').replace('T', ''))
+        return runs
+
+    def _cache_directory(self) -> str:
+        return self._model
+
+    def _fingerprint(self) -> str | None:
+        # NOTE the held data, the selected run differs from it if aggregating that run failed
+        return None if self._dataset is None else self._loaded
+
+    def _selected_fingerprint(self) -> str | None:
+        '''
+        Identifies the data of the selected run
+        '''
+        if self._run is None:
+            return None
+        variables = ','.join(sorted(self._needed_variables))
+        # NOTE the steps are not included, views are told apart by their coordinates, see Manager._fingerprint_job()
+        return f'{self._model}_{self._date}{self._run}_{variables}_{self._levels}_{self._area}_{self._points_key()}_{self._dtype}_{self._pack}'
+
+    def _list_needed_files(self, steps: list[int] | None = None, run: str | None = None) -> list:
+        '''
+        (url, destination) of all needed files of run (YYYYMMDDHH), the selected one by default
+        '''
+        if run is None:
+            run = f'{self._date}{self._run}'
         filelist = []
 
-        for var, step in itertools.product(self._needed_variables, self._steps):
-            url_base = f"{BASE}/{self._model}/grib/{self._run}/{self._VAR_MAPPING[var]['path']}"
+        for var, step in itertools.product(self._needed_variables, self._steps if steps is None else steps):
+            url_base = f"{BASE}/{self._model}/grib/{run[8:10]}/{self._VAR_MAPPING[var]['path']}"
             if self._VAR_MAPPING[var]['plev']:
-                l =  [self._construct_filename(step, var, l) for l in self._levels]
+                l =  [self._construct_filename(step, var, l, run) for l in self._levels]
                 filelist += [(f'{url_base}/{f}.bz2', os.path.join(self._download_dir,f)) for f in l]
             else:
-                f = self._construct_filename(step, var)
+                f = self._construct_filename(step, var, run=run)
                 filelist.append((f'{url_base}/{f}.bz2', os.path.join(self._download_dir,f)))
 
         return filelist
 
-    def _construct_filename(self, step, var, level = None) -> str:
-        run, date = self._run, self._date
+    def _construct_filename(self, step, var, level = None, run: str | None = None) -> str:
+        run, date = (self._run, self._date) if run is None else (run[8:10], run[:8])
         step_str = f'{step:03d}'
         v = self._VAR_MAPPING[var]['path']
         v_caps = v.upper() if self._caps_in_filename else v
@@ -209,6 +551,128 @@ class IconAggregator(Aggregator):
         logger.error("_query_dimensions not defined. returning empty (why?)")
         return []
 
+# NOTE YYYYMMDDHH, as in the filenames built by _construct_filename
+_RUN_PATTERN = re.compile(r'_(\d{10})_')
+
+_listing_lock = threading.Lock()
+# NOTE HDF5 is not thread safe, stores of aggregators running in threads are written and opened one at a time
+_store_lock = threading.Lock()
+_listing_downloader = download.Downloader(revalidate=True)
+# NOTE path -> time of the last check against the server
+_listing_checked = {}
+# NOTE (path, model) -> (mtime, parsed listing)
+_listing_cache = {}
+
+def _parse_listing(path: str, model: str) -> dict:
+    '''
+    filename (without .bz2) -> compressed size, for all files of model.
+    Parsed listings are kept until the file changes.
+    '''
+    key = (path, model)
+    mtime = os.path.getmtime(path)
+    if key in _listing_cache and _listing_cache[key][0] == mtime:
+        return _listing_cache[key][1]
+
+    marker = f'/{model}/grib/'
+    available = {}
+    opener = bz2.open if path.endswith('.bz2') else open
+    with opener(path, 'rt') as f:
+        for line in f:
+            if marker not in line:
+                continue
+            parts = line.rstrip('\n').split('|')
+            name = os.path.basename(parts[0]).removesuffix('.bz2')
+            available[name] = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+
+    _listing_cache[key] = (mtime, available)
+    return available
+
+# NOTE int16 values used for packed data, -32768 marks missing values
+_PACK_STEPS = 2 * 32767 - 2
+_PACK_FILL = -32768
+
+def _pack_encoding(var: xr.DataArray, precision: float | None = None) -> dict:
+    '''
+    Encoding of var as int16 with scale and offset. precision is the wanted resolution,
+    a coarser one is used if the range of the data does not fit otherwise.
+    Empty, so var is stored as it is, if it has no range, e.g. all missing after crop().
+    '''
+    values = var.values
+    finite = np.isfinite(values)
+    if not finite.any() or np.isinf(values).any():
+        logger.info(f"{var.name}: no finite range, not packing it")
+        return {}
+
+    low, high = float(values[finite].min()), float(values[finite].max())
+    scale = max((high - low) / _PACK_STEPS, float(np.finfo(np.float32).tiny))
+    if precision is not None and precision >= scale:
+        scale = precision
+    elif precision is not None:
+        logger.warning(f"{var.name}: precision {precision} does not fit into int16, using {scale:.3g}")
+
+    # NOTE float32, so the data is decoded as float32 again
+    return {'dtype': 'int16', 'scale_factor': np.float32(scale),
+            'add_offset': np.float32((high + low) / 2), '_FillValue': np.int16(_PACK_FILL)}
+
+def _write_store(ds: xr.Dataset, path: str, pack: bool | dict = False) -> None:
+    '''
+    Writes atomically, chunked by field, so single steps and levels can be read on their own.
+    Fields selected by pack are stored as int16, see _pack_encoding()
+    '''
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        encoding[name] = {}
+        if Dimension.LATITUDE in var.dims and Dimension.LONGITUDE in var.dims:
+            encoding[name]['chunksizes'] = [ds.sizes[d] if d in (Dimension.LATITUDE, Dimension.LONGITUDE) else 1 for d in var.dims]
+        if not np.issubdtype(var.dtype, np.floating):
+            continue
+        if pack is True:
+            encoding[name].update(_pack_encoding(var))
+        elif isinstance(pack, dict) and name in pack:
+            encoding[name].update(_pack_encoding(var, float(pack[name])))
+
+    # NOTE aggregators with the same data may write the same store at once
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with timing.stage('store', file=os.path.basename(path)) as t:
+        try:
+            with _store_lock:
+                ds.to_netcdf(tmp, engine='netcdf4', encoding=encoding)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        t['bytes'] = os.path.getsize(path)
+
+def _open_store(path: str, chunks: dict | None = None) -> xr.Dataset:
+    with timing.stage('open', file=os.path.basename(path)) as t:
+        t['bytes'] = os.path.getsize(path)
+        with _store_lock:
+            ds = xr.open_dataset(path, engine='netcdf4', chunks=chunks)
+    # NOTE NetCDF does not keep indexes on coordinates which are not dimensions
+    for coord in [Dimension.TIME, Dimension.PRESSURE]:
+        if coord in ds.coords:
+            ds = ds.set_xindex(coord)
+    return ds
+
+def _decode_grib(args) -> tuple[xr.Dataset, dict]:
+    '''
+    Runs in a worker process, so the data is loaded before it is sent back
+    and the timing is returned instead of recorded
+    '''
+    path, kwargs, area, points = args
+    with timing.stage('open', record=False, file=os.path.basename(path)) as t:
+        t['bytes'] = os.path.getsize(path)
+        ds = _reduce(xr.open_dataset(path, **kwargs), area, points).load()
+    return ds, t
+
+def _reduce(ds: xr.Dataset, area: tuple | None, points: tuple | None) -> xr.Dataset:
+    return extract_points(crop(ds, area), points)
+
+def _open_grib(path, **kwargs) -> xr.Dataset:
+    with timing.stage('open', file=os.path.basename(path)) as t:
+        t['bytes'] = os.path.getsize(path)
+        return xr.open_dataset(path, **kwargs)
+
 def get_current_run():
     # we allow up to 3h of slack for DWD to upload the latest run
     now = datetime.datetime.now(datetime.timezone.utc)
@@ -217,30 +681,3 @@ def get_current_run():
     run = int(corrected.hour / 6) * 6
 
     return (f'{run:02d}', corrected.strftime('%Y%m%d'))
-
-def download_url(args):
-    url, dest = args
-
-    if os.path.exists(dest):
-        return
-
-    r = requests.get(url)
-    if not r.ok:
-        logger.error(f'Failed Request to download {dest}:\n')
-        logger.error(f'URL {url}, {dest}:\n')
-        return
-    try:
-        with open(dest, 'wb') as f:
-            f.write(bz2.decompress(r.content))
-        logger.debug(f'Downloaded {dest}')
-    except Exception as e:
-        logger.error(f'Failed to download {dest}:\n', e)
-
-
-def clean_output_dir(directory, target):
-    to_delete = [f for f  in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
-    if target in to_delete:
-        del to_delete[to_delete.index(target)]
-
-    for f in to_delete:
-        os.unlink(os.path.join(directory, f))
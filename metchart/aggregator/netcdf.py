@@ -5,24 +5,34 @@ aggregator:
     module: metchart.aggregator.netcdf.NetCDFAggregator
     files:
       - a.nc
+    # optional, load lazily in chunks. true uses the chunks of the file
+    chunks: {time: 1}
     dimension_map:
       dim_in_file: metchart_dimension
     variable_map:
       var_in_file: metchart_variable
 ```
 '''
-from metchart.aggregator import Aggregator, Variable, Dimension
+from metchart.aggregator import Aggregator, Variable, Dimension, dask_chunks, crop, parse_area
+from metchart import timing
 import xarray as xr
+import os
 
 import logging
 logger = logging.getLogger(__name__)
 
 class NetCDFAggregator(Aggregator):
     def _init(self):
-        pass
+        # NOTE fingerprint of the files self._dataset was read from
+        self._loaded = None
 
-    def _load_config(self, files: list[str] = [], dimension_map: dict = {}, variable_map: dict = {}) -> None:
+    def _load_config(self, files: list[str] = [], dimension_map: dict = {}, variable_map: dict = {},
+                     chunks: bool | dict | None = None, area: list[float] | None = None) -> None:
         self._files = files
+        # NOTE lazy dask arrays instead of loading, see dask_chunks()
+        self._chunks = dask_chunks(chunks)
+        # NOTE [west, east, south, north], applied before anything is loaded
+        self._area = parse_area(area)
 
         # NOTE maps are '<original>: <metchart Variable name>'
         self._dim_map = dimension_map
@@ -35,27 +45,47 @@ class NetCDFAggregator(Aggregator):
 
     def _aggregate(self) -> None:
         print(self._needed_variables)
+        loaded = self._poll()
+        self._dataset = self._open()
+        self._loaded = loaded
 
+    def _plan(self) -> dict:
+        # NOTE opening is lazy, only metadata is read
+        ds = self._open()
+        return {'files': [], 'dataset': ds.drop_vars(list(ds.data_vars))}
+
+    def _open(self) -> xr.Dataset:
         dss = []
         for f in self._files:
-            dss.append( xr.open_dataset(f, engine='netcdf4') )
+            with timing.stage('load', aggregator=self._name, file=f) as t:
+                dss.append( xr.open_dataset(f, engine='netcdf4', chunks=self._chunks) )
+                t['bytes'] = os.path.getsize(f)
 
-        self._dataset = xr.merge(dss)
-        self._dataset = self._dataset.rename_vars(
-            { k: Variable(v) for k, v in self._var_map.items() if k in self._dataset and not k == v }
+        ds = xr.merge(dss)
+        ds = ds.rename_vars(
+            { k: Variable(v) for k, v in self._var_map.items() if k in ds and not k == v }
         )
-        self._dataset = self._dataset.rename_dims(
-            { k: Dimension(v) for k, v in self._dim_map.items() if k in self._dataset and not k == v}
+        ds = ds.rename_dims(
+            { k: Dimension(v) for k, v in self._dim_map.items() if k in ds and not k == v}
         )
 
-        vars_to_delete = [ v for v in self._dataset.keys() if v not in self._can_provide ]
+        vars_to_delete = [ v for v in ds.keys() if v not in self._can_provide ]
         dims_to_delete = [
-                v for v in self._dataset.dims
+                v for v in ds.dims
                     if v not in self._can_provide
                         and v not in [ self._dim_map[v] for v in self._dim_map ]
         ]
 
         logger.debug(f'Vars to delete: {vars_to_delete}')
-        self._dataset = self._dataset.drop_vars(vars_to_delete)
+        ds = ds.drop_vars(vars_to_delete)
         logger.debug(f'Dims to delete: {dims_to_delete}')
-        self._dataset = self._dataset.drop_dims(dims_to_delete)
+        return crop(ds.drop_dims(dims_to_delete), self._area)
+
+    def _poll(self) -> str | None:
+        stats = [os.stat(f) for f in self._files]
+        files = '_'.join([f'{f}:{s.st_size}:{s.st_mtime_ns}' for f, s in zip(self._files, stats)])
+        return f'{files}_{self._var_map}_{self._dim_map}_{self._area}'
+
+    def _fingerprint(self) -> str | None:
+        # NOTE the files may have changed since, e.g. if aggregating them again failed
+        return self._loaded
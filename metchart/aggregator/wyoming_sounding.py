@@ -11,9 +11,6 @@ import numpy as np
 import logging
 logger = logging.getLogger(__name__)
 
-from metpy.units import units
-import metpy.calc as mpcalc
-
 from .. import misc
 
 from ..aggregator import Aggregator, Variable, Dimension
@@ -32,30 +29,75 @@ class WyomingSoundingAggregator(Aggregator):
         self._stations = []
 
     def _load_config(self, station: int) -> None:
-        self._hour, self._date = get_current_run()
         #self._stations = stations
         self._station = station
+
+        self._download_dir = os.path.join(self._cache_dir, self._cache_directory())
+        misc.create_output_dir(self._download_dir)
         logger.debug(f"Configured station {self._station}")
 
     def _aggregate(self) -> None:
         #dss = []
         #for station in self._stations:
+            self._select_run()
             station = self._station
-            target = os.path.join(self._cache_dir, f'{station}_{self._date}_{self._hour}.csv')
+            target = os.path.join(self._download_dir, f'{station}_{self._date}_{self._hour}.csv')
 
             download_wyoming_csv(station, self._date, self._hour, target)
             self._dataset = load_wyoming_csv(target, self._hour, self._date, station)
             #dss.append(ds)
         #self._dataset = xr.concat(dss, dim=Dimension.STATION)
 
+    def _plan(self) -> dict:
+        self._select_run()
+        target = os.path.join(self._download_dir, f'{self._station}_{self._date}_{self._hour}.csv')
+        time = np.datetime64(f'{self._date}T{self._hour}')
+
+        return {
+            # NOTE size is unknown, depends on the sounding
+            'files': [{
+                'source': wyoming_url(self._station, self._date, self._hour),
+                'destination': target,
+                'bytes': None,
+                'cached': os.path.exists(target)
+            }],
+            'dataset': xr.Dataset(coords={
+                Dimension.TIME: time,
+                Dimension.INIT_TIME: time,
+                Dimension.STATION: self._station,
+            }),
+        }
+
+    def _select_run(self) -> None:
+        self._hour, self._date = get_current_run()
+
+    def _poll(self) -> str | None:
+        hour, date = get_current_run()
+        return f'{self._station}_{date}_{hour}'
+
+    def _run_of(self, filename: str) -> str | None:
+        # NOTE {station}_{date}_{hour}.csv
+        return filename.removesuffix('.csv').split('_', 1)[-1]
+
+    def _runs_in_use(self) -> list[str]:
+        return [] if self._date is None else [f'{self._date}_{self._hour}']
+
+    def _fingerprint(self) -> str | None:
+        if self._date is None:
+            return None
+        return f'{self._station}_{self._date}_{self._hour}'
+
 def get_current_run():
     date=(datetime.date.today() - datetime.timedelta(days = 1)).strftime('%Y-%m-%d')
     # TODO we also want noon
     hour='23:00:00'
     return (hour, date)
 
+def wyoming_url(station, date, hour) -> str:
+    return f'http://weather.uwyo.edu/cgi-bin/bufrraob.py?datetime={date}%20{hour}&id={station}&type=TEXT:CSV'
+
 def download_wyoming_csv(station, date, hour, target):
-    url=f'http://weather.uwyo.edu/cgi-bin/bufrraob.py?datetime={date}%20{hour}&id={station}&type=TEXT:CSV'
+    url = wyoming_url(station, date, hour)
     result = requests.get(url)
 
     if not result.ok:
@@ -68,6 +110,10 @@ def download_wyoming_csv(station, date, hour, target):
     logger.debug(f"Downloaded f{target}")
 
 def load_wyoming_csv(filepath, hour, date, station):
+    # NOTE deferred, loading metpy is slow
+    from metpy.units import units
+    import metpy.calc as mpcalc
+
     p = []
     T = []
     Td = []
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+'''
+Benchmarks
+
+`metchart-benchmark startup` measures how long it takes a fresh interpreter
+to import metchart and resolve every bundled plugin. It fails if the median
+exceeds the budget, so heavy module level imports are caught early.
+
+`metchart-benchmark suite` times the aggregation and plotting hot paths on
+synthetic data at several grid sizes, level and step counts. No network is needed.
+Results can be written to a file and compared with `metchart-benchmark compare`.
+
+`metchart-benchmark precision` aggregates synthetic ICON data as float64, float32
+and int16 packed store, each in a fresh interpreter. It reports peak memory and store
+size and fails if the plots differ visibly from the float64 ones.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+import itertools
+import statistics
+import subprocess
+
+import logging
+logger = logging.getLogger(__name__)
+
+# NOTE seconds, from starting the interpreter until it exits, as noticed on the command line
+STARTUP_BUDGET = 1.2
+
+_STARTUP_CODE = '''
+import metchart.run
+from metchart import plugins
+for name in plugins.ALIASES:
+    plugins.resolve(name)
+'''
+
+_PRECISION_CODE = '''
+import sys, json
+from metchart.benchmark import run_precision
+print(json.dumps(run_precision(*json.loads(sys.argv[1]))))
+'''
+
+# NOTE of a color channel, from 0 to 1
+_VISIBLE_DIFFERENCE = 0.1
+
+# NOTE aggregator settings per variant, float64 is the reference
+PRECISION_VARIANTS = {
+    'float64': {'dtype': 'float64'},
+    'float32': {'dtype': 'float32'},
+    'int16': {'dtype': 'float32', 'pack': True},
+}
+
+# NOTE points for the point plotters, inside the default synthetic area
+_POINTS = [
+    {'name': 'antersberg', 'query': {'latitude': 47.96, 'longitude': 11.99, 'method': 'nearest'}},
+    {'name': 'munich', 'query': {'latitude': 48.16, 'longitude': 11.57, 'method': 'nearest'}},
+]
+
+def _measure(func, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t)
+
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'max': max(samples),
+        'samples': samples,
+    }
+
+def bench_startup(repeat: int = 5) -> dict:
+    return _measure(lambda: subprocess.run([sys.executable, '-c', _STARTUP_CODE], check=True, capture_output=True), repeat)
+
+def bench_icon(workdir: str, nlat: int, nlon: int, levels: int, steps: int, repeat: int, store: bool = False) -> dict:
+    from .aggregator import Variable
+    from .aggregator.dwd_icon import IconAggregator
+    from . import synthetic
+
+    # NOTE aggregators of a model share their downloads, so every grid gets its own cache
+    cache_dir = os.path.join(workdir, f'icon_{nlat}x{nlon}_{levels}_{steps}')
+    os.makedirs(cache_dir, exist_ok=True)
+    agg = IconAggregator(cache_dir, 'icon')
+    agg.load_config(model='icon-eu',
+                    pressure_levels=[int(l) for l in _levels(levels)],
+                    steps=[3 * s for s in range(steps)],
+                    run='2024010100',
+                    store=store)
+    for var in [Variable.TEMPERATURE_3D, Variable.HUMIDITY_3D, Variable.U_3D, Variable.V_3D,
+                Variable.TEMPERATURE_SURFACE, Variable.PRESSURE_SEA_LEVEL]:
+        agg.add_needed(var)
+
+    synthetic.write_icon_files(agg, nlat, nlon)
+
+    if not store:
+        return _measure(agg._aggregate, repeat)
+
+    # NOTE the first aggregation writes the store, later ones only read it
+    agg._aggregate()
+    return _measure(lambda: (agg._aggregate(), agg._dataset.load()), repeat)
+
+def bench_netcdf(workdir: str, nlat: int, nlon: int, levels: int, steps: int, repeat: int) -> dict:
+    from .aggregator.netcdf import NetCDFAggregator
+    from . import synthetic
+
+    path = os.path.join(workdir, f'synthetic_{nlat}x{nlon}_{levels}_{steps}.nc')
+    ds = synthetic.write_netcdf(path, nlat=nlat, nlon=nlon, steps=steps, levels=_levels(levels))
+
+    agg = NetCDFAggregator(workdir, 'netcdf')
+    agg.load_config(files=[path],
+                    dimension_map={str(d): str(d) for d in ds.dims},
+                    variable_map={str(v): str(v) for v in ds.data_vars})
+
+    # NOTE opening is lazy, loading is part of the hot path
+    return _measure(lambda: (agg._aggregate(), agg._dataset.load()), repeat)
+
+def bench_wyoming(workdir: str, levels: int, repeat: int) -> dict:
+    from .aggregator.wyoming_sounding import load_wyoming_csv
+    from . import synthetic
+
+    path = os.path.join(workdir, f'sounding_{levels}.csv')
+    synthetic.write_wyoming_csv(path, levels)
+
+    # NOTE import time of metpy is covered by the startup benchmark
+    import metpy.calc
+
+    return _measure(lambda: load_wyoming_csv(path, '00:00:00', '2024-01-01', 10868), repeat)
+
+def bench_dataview(nlat: int, nlon: int, levels: int, steps: int, repeat: int) -> dict:
+    from .aggregator import DataView
+    from . import synthetic
+
+    ds = synthetic.dataset(nlat=nlat, nlon=nlon, steps=steps, levels=_levels(levels))
+
+    def run():
+        for query_view in DataView(ds, name='bench').for_queries(_POINTS):
+            for view in query_view.along_dimensions(['time']):
+                view.get()
+
+    return _measure(run, repeat)
+
+def bench_points(nlat: int, nlon: int, levels: int, steps: int, count: int, repeat: int) -> dict:
+    import numpy as np
+    from .aggregator import DataView
+    from . import synthetic
+
+    ds = synthetic.dataset(nlat=nlat, nlon=nlon, steps=steps, levels=_levels(levels))
+
+    # NOTE like airfields for meteograms, inside the default synthetic area
+    rng = np.random.default_rng(0)
+    queries = [
+        {'name': f'point{i}', 'query': {'latitude': lat, 'longitude': lon, 'method': 'nearest'}}
+            for i, (lat, lon) in enumerate(zip(rng.uniform(47., 55.5, count), rng.uniform(5.5, 15.5, count)))
+    ]
+
+    def run():
+        for view in DataView(ds, name='bench').for_queries(queries):
+            view.get()
+
+    return _measure(run, repeat)
+
+def bench_plotter(workdir: str, plotter: str, nlat: int, nlon: int, levels: int, steps: int, repeat: int) -> dict:
+    from .aggregator import DataView
+    from . import plugins
+    from . import synthetic
+
+    configs = {
+        'horizontal': ({'layers': [
+            {'layertype': 'raster', 'field': 'temperature_surface'},
+            {'layertype': 'barbs', 'field': ['u_surface', 'v_surface']},
+        ]}, [], ['time']),
+        'meteogram': ({}, _POINTS[:1], []),
+        'skewt': ({}, _POINTS[:1], ['time']),
+        'graph': ({'x_dim': 'pressure', 'vars': ['temperature_3d']}, _POINTS[:1], ['time']),
+    }
+    cfg, queries, along = configs[plotter]
+
+    ds = synthetic.dataset(nlat=nlat, nlon=nlon, steps=steps, levels=_levels(levels))
+    obj = plugins.resolve(plotter)(workdir, workdir, plotter, None)
+    obj.load_config(**cfg)
+    obj.warm_up()
+
+    # NOTE one plot per sample, the first view is as good as any other
+    view = next(next(iter(DataView(ds, name=plotter).for_queries(queries))).along_dimensions(along))
+    return _measure(lambda: obj.plot(view, view.generate_unique_name()), repeat)
+
+def run_precision(workdir: str, variant: str, nlat: int, nlon: int, levels: int, steps: int) -> dict:
+    '''
+    Aggregates and plots one variant of bench_precision(), meant to run in a fresh interpreter
+    '''
+    import resource
+    import matplotlib as mpl
+    mpl.use('agg')
+
+    from .aggregator import DataView, Variable
+    from .aggregator.dwd_icon import IconAggregator
+    from . import customization
+    from . import plugins
+    from . import synthetic
+    customization.register_units()
+    customization.register_colormaps()
+
+    # NOTE one process, so the peak memory is not spread over decode workers
+    agg = IconAggregator(workdir, f'precision_{variant}')
+    agg.load_config(model='icon-eu',
+                    pressure_levels=[int(l) for l in _levels(levels)],
+                    steps=[3 * s for s in range(steps)],
+                    run='2024010100',
+                    decode_workers=1,
+                    **PRECISION_VARIANTS[variant])
+    for var in [Variable.TEMPERATURE_3D, Variable.HUMIDITY_3D, Variable.U_3D, Variable.V_3D,
+                Variable.TEMPERATURE_SURFACE, Variable.U_SURFACE, Variable.V_SURFACE]:
+        agg.add_needed(var)
+    # NOTE inside the area of the points
+    synthetic.write_icon_files(agg, nlat, nlon, area=(5.5, 15.5, 47., 55.5))
+
+    agg.aggregate()
+    ds = agg._dataset.load()
+
+    images = {}
+    for plotter, cfg, queries, along in [
+            ('skewt', {}, _POINTS[:1], ['time']),
+            ('graph', {'x_dim': 'pressure', 'vars': ['temperature_3d', 'humidity_3d']}, _POINTS[:1], ['time']),
+            ('horizontal', {'layers': [
+                {'layertype': 'raster', 'field': 'temperature_surface'},
+                {'layertype': 'barbs', 'field': ['u_surface', 'v_surface']},
+            ]}, [], ['time'])]:
+        output = os.path.join(workdir, variant)
+        os.makedirs(output, exist_ok=True)
+        try:
+            obj = plugins.resolve(plotter)(workdir, output, plotter, None)
+            obj.load_config(**cfg)
+            view = next(next(iter(DataView(ds, name=plotter).for_queries(queries))).along_dimensions(along))
+            images[plotter] = os.path.join(output, obj.plot(view, view.generate_unique_name()))
+        except ImportError as e:
+            logger.warning(f'{plotter} skipped: {e}')
+
+    return {
+        # NOTE kilobytes on Linux
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'dataset_bytes': ds.nbytes,
+        'store_bytes': os.path.getsize(agg._store_path()),
+        'images': images,
+    }
+
+def _image_difference(a: str, b: str) -> float:
+    '''
+    Fraction of pixels with a visibly different color
+    '''
+    import numpy as np
+    import matplotlib.image
+
+    x, y = matplotlib.image.imread(a), matplotlib.image.imread(b)
+    if x.shape != y.shape:
+        return 1.
+    # NOTE anti-aliasing of lines shifted by a fraction of a pixel changes colors slightly
+    return float((np.abs(x - y).max(axis=-1) > _VISIBLE_DIFFERENCE).mean())
+
+def bench_precision(workdir: str, nlat: int, nlon: int, levels: int, steps: int) -> dict:
+    results = {}
+    for variant in PRECISION_VARIANTS:
+        out = subprocess.run([sys.executable, '-c', _PRECISION_CODE,
+                              json.dumps([workdir, variant, nlat, nlon, levels, steps])],
+                             check=True, capture_output=True, text=True)
+        results[variant] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    reference = results['float64']['images']
+    for variant in results:
+        results[variant]['image_difference'] = {
+            plotter: _image_difference(reference[plotter], image)
+                for plotter, image in results[variant]['images'].items()
+        }
+    return results
+
+def _levels(count: int) -> list:
+    # NOTE the meteogram needs 850hPa, so the common levels come first
+    levels = [1000., 850., 500., 700., 300., 950., 900., 800., 600., 400., 200.][:count]
+    return sorted(levels, reverse=True)
+
+def _grid(s: str) -> tuple[int, int]:
+    nlat, nlon = s.lower().split('x')
+    return int(nlat), int(nlon)
+
+def _version() -> str:
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version('metchart')
+    except PackageNotFoundError:
+        return 'unknown'
+
+def _run_suite(args) -> dict:
+    import matplotlib as mpl
+    mpl.use('agg')
+
+    from . import customization
+    customization.register_units()
+    customization.register_colormaps()
+
+    selected = args.only.split(',') if args.only else None
+    def wanted(name):
+        return selected is None or any([name.startswith(s) for s in selected])
+
+    results = []
+    def add(name, params, func, *fargs):
+        if not wanted(name):
+            return
+        logger.info(f'{name} {params}')
+        try:
+            result = func(*fargs)
+        except ImportError as e:
+            logger.warning(f'{name} skipped: {e}')
+            return
+        results.append({'benchmark': name, 'params': params} | result)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        add('startup', {}, bench_startup, args.repeat)
+
+        for levels in args.levels:
+            add('aggregate.wyoming', {'levels': levels * 10}, bench_wyoming, workdir, levels * 10, args.repeat)
+
+        for grid, levels, steps in itertools.product(args.grids, args.levels, args.steps):
+            nlat, nlon = _grid(grid)
+            params = {'grid': grid, 'levels': levels, 'steps': steps}
+
+            add('aggregate.icon', params, bench_icon, workdir, nlat, nlon, levels, steps, args.repeat)
+            add('aggregate.icon_stored', params, bench_icon, workdir, nlat, nlon, levels, steps, args.repeat, True)
+            add('aggregate.netcdf', params, bench_netcdf, workdir, nlat, nlon, levels, steps, args.repeat)
+            add('dataview', params, bench_dataview, nlat, nlon, levels, steps, args.repeat)
+            add('dataview.points', params | {'points': 300}, bench_points, nlat, nlon, levels, steps, 300, args.repeat)
+
+            for plotter in ['horizontal', 'meteogram', 'skewt', 'graph']:
+                add(f'plot.{plotter}', params, bench_plotter, workdir, plotter, nlat, nlon, levels, steps, args.repeat)
+
+    return {
+        'version': _version(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'results': results,
+    }
+
+def _key(result: dict) -> str:
+    return f"{result['benchmark']} {json.dumps(result['params'], sort_keys=True)}"
+
+def _startup(args) -> int:
+    result = bench_startup(args.repeat)
+    print(json.dumps(result, indent=4))
+
+    if result['median'] > args.budget:
+        print(f"startup took {result['median']:.3f}s, budget is {args.budget:.3f}s", file=sys.stderr)
+        return 1
+    return 0
+
+def _suite(args) -> int:
+    suite = _run_suite(args)
+
+    for r in suite['results']:
+        print('{:<70} {:>10.4f}s'.format(_key(r), r['median']))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(suite, indent=4))
+    return 0
+
+def _compare(args) -> int:
+    with open(args.old, 'r') as f:
+        old = {_key(r): r for r in json.load(f)['results']}
+    with open(args.new, 'r') as f:
+        new = {_key(r): r for r in json.load(f)['results']}
+
+    print('{:<70} {:>10} {:>10} {:>8}'.format('benchmark', 'old [s]', 'new [s]', 'ratio'))
+    for key in new:
+        if key not in old:
+            continue
+        o, n = old[key]['median'], new[key]['median']
+        print('{:<70} {:>10.4f} {:>10.4f} {:>8.2f}'.format(key, o, n, n / o if o > 0 else float('nan')))
+    return 0
+
+def _precision(args) -> int:
+    nlat, nlon = _grid(args.grid)
+    with tempfile.TemporaryDirectory() as workdir:
+        results = bench_precision(workdir, nlat, nlon, args.levels, args.steps)
+
+    print('{:<10} {:>14} {:>14} {:>14} {:>12}'.format('variant', 'peak RSS [MB]', 'data [MB]', 'store [MB]', 'differing'))
+    failed = False
+    for variant, r in results.items():
+        diff = max(r['image_difference'].values(), default=0.)
+        failed = failed or diff > args.tolerance
+        print('{:<10} {:>14.1f} {:>14.1f} {:>14.1f} {:>12.5f}'.format(
+            variant, r['peak_rss'] / 1e6, r['dataset_bytes'] / 1e6, r['store_bytes'] / 1e6, diff))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=4))
+
+    if failed:
+        print(f'plots differ from float64 in more than {args.tolerance} of their pixels', file=sys.stderr)
+        return 1
+    return 0
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(name)s - %(message)s')
+    for noisy in ['matplotlib', 'cfgrib', 'gribapi', 'metpy', 'findlibs']:
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description='metchart benchmarks')
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    startup = sub.add_parser('startup', help='import time of metchart and all bundled plugins')
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='seconds')
+    startup.set_defaults(func=_startup)
+
+    suite = sub.add_parser('suite', help='aggregation and plotting on synthetic data')
+    suite.add_argument('--repeat', type=int, default=3)
+    suite.add_argument('--grids', type=lambda s: s.split(','), default=['50x60', '200x300'],
+                       help='comma separated NLATxNLON')
+    suite.add_argument('--levels', type=lambda s: [int(v) for v in s.split(',')], default=[3, 11])
+    suite.add_argument('--steps', type=lambda s: [int(v) for v in s.split(',')], default=[3, 9])
+    suite.add_argument('--only', default=None, help='comma separated benchmark name prefixes, e.g. aggregate,plot.skewt')
+    suite.add_argument('--output', metavar='FILE', default=None, help='store results as json')
+    suite.set_defaults(func=_suite)
+
+    precision = sub.add_parser('precision', help='memory, store size and plots of float64, float32 and int16 data')
+    precision.add_argument('--grid', default='200x300', help='NLATxNLON')
+    precision.add_argument('--levels', type=int, default=11)
+    precision.add_argument('--steps', type=int, default=9)
+    precision.add_argument('--tolerance', type=float, default=0.001, help='fraction of pixels a plot may differ in')
+    precision.add_argument('--output', metavar='FILE', default=None, help='store results as json')
+    precision.set_defaults(func=_precision)
+
+    compare = sub.add_parser('compare', help='compare two stored suite results')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.set_defaults(func=_compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == '__main__':
+    main()
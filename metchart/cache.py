@@ -0,0 +1,214 @@
+'''
+Cache eviction
+
+Bounds the size of the download cache. Files in the cache directory of an
+aggregator are grouped by model run and whole runs are evicted, least
+recently used first. The most recently used run of every directory is
+always kept, plotters may still read from it.
+
+Directories can be shared by several aggregators and metchart processes,
+lock() serializes work on the same run.
+'''
+import os
+import time
+import fcntl
+import threading
+import contextlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+_UNITS = {'K': 10**3, 'M': 10**6, 'G': 10**9, 'T': 10**12}
+
+LOCK_FILE = '.lock'
+
+# NOTE directory -> descriptor of its lock file. Kept open, closing any descriptor
+# of a file releases all record locks the process holds on it
+_lock_files = {}
+# NOTE (directory, key) -> lock, record locks do not exclude threads of the same process
+_thread_locks = {}
+_locks_lock = threading.Lock()
+
+@contextlib.contextmanager
+def lock(directory: str, key: int, blocking: bool = True):
+    '''
+    Exclusive lock on key within directory, across threads and processes.
+    key is a byte offset in the lock file, e.g. a run as YYYYMMDDHH.
+    Yields whether the lock is held, which without blocking is False if someone else holds it.
+    '''
+    # NOTE record locks of one process do not exclude each other, so each file is opened once
+    directory = os.path.abspath(directory)
+    with _locks_lock:
+        if directory not in _lock_files:
+            _lock_files[directory] = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        fd = _lock_files[directory]
+        thread_lock = _thread_locks.setdefault((directory, key), threading.Lock())
+
+    if not thread_lock.acquire(blocking):
+        yield False
+        return
+    try:
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB, 1, key)
+            locked = True
+        except OSError:
+            if blocking:
+                raise
+            locked = False
+
+        try:
+            yield locked
+        finally:
+            if locked:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, key)
+    finally:
+        thread_lock.release()
+
+def parse_size(value) -> int:
+    '''
+    Bytes from an int or a string like '20G'
+    '''
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip().upper().removesuffix('B')
+    if value[-1:] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(value)
+
+def touch(path: str) -> None:
+    '''
+    Marks a cached file as used
+    '''
+    # NOTE only the access time, cfgrib ignores indices older than the GRIB file
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+    except OSError as e:
+        logger.debug(f"Could not touch {path}: {e}")
+
+def _is_bookkeeping(filename: str) -> bool:
+    # NOTE e.g. the download manifest, it is not part of any run
+    return filename.endswith('.json') or filename.endswith('.json.tmp') or filename == LOCK_FILE
+
+def _is_index(filename: str) -> bool:
+    return filename.endswith('.idx')
+
+def _indexed_file(filename: str) -> str:
+    # NOTE cfgrib names its indices <file>.<hash>.idx
+    return os.path.splitext(filename.removesuffix('.idx'))[0]
+
+class Cache:
+    def __init__(self, cache_dir: str, max_bytes: int | None = None,
+                 max_runs: int | None = None, max_age: float | None = None):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        # NOTE per directory
+        self._max_runs = max_runs
+        # NOTE hours
+        self._max_age = max_age
+
+    def clean(self, run_of: dict, protected: set | None = None) -> int:
+        '''
+        Removes orphaned indices and evicts runs exceeding the limits.
+        run_of maps a directory name to a function returning the run of a file,
+        or None if the file is a run of its own.
+        protected holds (directory name, run) of runs in use, which are never evicted.
+        Returns the number of freed bytes.
+        '''
+        freed = self._remove_orphaned_indices()
+
+        groups = self._groups(run_of)
+        evict = set()
+
+        # NOTE newest first per directory, the newest one is never evicted
+        by_dir = {}
+        for g in sorted(groups, key=lambda g: groups[g]['used'], reverse=True):
+            by_dir.setdefault(g[0], []).append(g)
+        keep = set([runs[0] for runs in by_dir.values()])
+        # NOTE directories are shared, e.g. by aggregators of a pinned and the latest run
+        keep.update(set(groups) & (protected or set()))
+
+        if self._max_runs is not None:
+            for runs in by_dir.values():
+                evict.update(runs[max(self._max_runs, 1):])
+
+        if self._max_age is not None:
+            oldest = time.time() - self._max_age * 3600
+            evict.update([g for g in groups if groups[g]['used'] < oldest and g not in keep])
+        evict -= keep
+
+        if self._max_bytes is not None:
+            total = sum([groups[g]['bytes'] for g in groups if g not in evict])
+            for g in sorted(groups, key=lambda g: groups[g]['used']):
+                if total <= self._max_bytes:
+                    break
+                if g in keep or g in evict:
+                    continue
+                evict.add(g)
+                total -= groups[g]['bytes']
+            if total > self._max_bytes:
+                logger.warning(f"Cache exceeds {self._max_bytes} bytes with only the latest runs left")
+
+        for g in evict:
+            freed += self._evict(g, groups[g]['files'])
+
+        # NOTE indices of evicted files
+        freed += self._remove_orphaned_indices()
+        return freed
+
+    def _groups(self, run_of: dict) -> dict:
+        '''
+        (directory, run) -> files, bytes and time of last use
+        '''
+        groups = {}
+        for d in sorted(os.listdir(self._cache_dir)):
+            directory = os.path.join(self._cache_dir, d)
+            # NOTE files in the cache root belong to metchart itself, e.g. the render cache
+            if not os.path.isdir(directory):
+                continue
+
+            func = run_of.get(d, lambda f: None)
+            for entry in os.scandir(directory):
+                if not entry.is_file() or _is_index(entry.name) or _is_bookkeeping(entry.name):
+                    continue
+                run = func(entry.name)
+                g = groups.setdefault((d, entry.name if run is None else run), {'files': [], 'bytes': 0, 'used': 0.})
+                stat = entry.stat()
+                g['files'].append(entry.path)
+                g['bytes'] += stat.st_size
+                g['used'] = max(g['used'], stat.st_atime, stat.st_mtime)
+
+        return groups
+
+    def _evict(self, group: tuple, files: list[str]) -> int:
+        directory, run = group
+        if not run.isdigit():
+            logger.info(f"Evicting {run} of {directory} from cache")
+            return sum([self._remove(path) for path in files])
+
+        # NOTE runs as YYYYMMDDHH are locked while they are downloaded, see lock()
+        with lock(os.path.join(self._cache_dir, directory), int(run), blocking=False) as locked:
+            if not locked:
+                logger.info(f"Run {run} of {directory} is in use, not evicting it")
+                return 0
+            logger.info(f"Evicting run {run} of {directory} from cache")
+            return sum([self._remove(path) for path in files])
+
+    def _remove_orphaned_indices(self) -> int:
+        freed = 0
+        for d in os.listdir(self._cache_dir):
+            directory = os.path.join(self._cache_dir, d)
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if _is_index(entry.name) and not os.path.exists(os.path.join(directory, _indexed_file(entry.name))):
+                    freed += self._remove(entry.path)
+        return freed
+
+    def _remove(self, path: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+            return size
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+            return 0
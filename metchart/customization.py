@@ -1,9 +1,9 @@
-from metpy.units import units
-
-import matplotlib as mpl
-from matplotlib.colors import LinearSegmentedColormap
+# NOTE imports are deferred into the functions, loading metpy is slow
 
 def register_colormaps():
+    import matplotlib as mpl
+    from matplotlib.colors import LinearSegmentedColormap
+
     # Define custom colormap
     clcov_cmap = {
         'red': (
@@ -26,6 +26,8 @@ def register_colormaps():
     mpl.colormaps.register(LinearSegmentedColormap('clcov', clcov_cmap))
 
 def register_units():
+    from metpy.units import units
+
     # Define custom gpm and gpdm units. The default gpm in metpy is aliased to meter.
     # We need the correct definition
     units.define('_gpm = 9.80665 * J/kg')
@@ -0,0 +1,136 @@
+'''
+Daemon
+
+Keeps metchart resident. Every interval all aggregators are polled,
+only those with new data are aggregated again and the plots are
+rendered by worker processes that stay warm between runs.
+'''
+import os
+import json
+import time
+import datetime
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+from metchart.manager import Manager
+
+STATUS_FILE = 'status.json'
+# NOTE seconds between status updates while a run is in progress
+STATUS_INTERVAL = 5
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+class Daemon:
+    def __init__(self, manager: Manager, interval: float = 300, status_file: str | None = None):
+        self._manager = manager
+        # NOTE polling may depend on the needed variables, e.g. to find a complete run
+        self._manager.register_needed()
+        self._interval = interval
+        self._status_file = status_file if status_file is not None else os.path.join(manager._output_dir, STATUS_FILE)
+
+        # NOTE last polled id per aggregator, None before the first aggregation
+        self._data = { key: None for key in manager.aggregators }
+        self._status = {
+            'state': 'starting',
+            'started': _now(),
+            'last_run': None,
+            'last_duration': None,
+            'last_error': None,
+            'runs': 0,
+            'next_poll': None,
+            'aggregators': { key: {'data': None, 'updated': None} for key in manager.aggregators },
+        }
+
+    def run_forever(self) -> None:
+        self._manager.start_workers()
+        try:
+            while True:
+                self.tick()
+                self._status['next_poll'] = (datetime.datetime.now(datetime.timezone.utc)
+                                             + datetime.timedelta(seconds=self._interval)).isoformat(timespec='seconds')
+                self._write_status()
+                time.sleep(self._interval)
+        finally:
+            self._status['state'] = 'stopped'
+            self._status['next_poll'] = None
+            self._write_status()
+            self._manager.stop_workers()
+
+    def tick(self) -> list[str]:
+        '''
+        Polls all aggregators and runs the pipeline for the changed ones.
+        Returns the keys of the aggregators that were aggregated again.
+        '''
+        self._status['state'] = 'polling'
+        self._write_status()
+
+        changed = []
+        polled = {}
+        for key in self._manager.aggregators:
+            try:
+                polled[key] = self._manager.aggregators[key].poll()
+            except Exception:
+                logger.exception(f"Polling {key} failed")
+                continue
+
+            # NOTE None means the aggregator can not tell, so it is always refreshed
+            if polled[key] is None or polled[key] != self._data[key]:
+                changed.append(key)
+
+        if len(changed) == 0:
+            logger.info("No new data")
+            self._status['state'] = 'idle'
+            return changed
+
+        logger.info(f"New data for {changed}")
+        self._status['state'] = 'running'
+        self._write_status()
+
+        done = threading.Event()
+        reporter = threading.Thread(target=self._report, args=(done,), daemon=True)
+        reporter.start()
+
+        start = time.perf_counter()
+        try:
+            aggregated = self._manager.run(aggregators=changed)
+            self._status['last_error'] = None
+        except Exception as e:
+            logger.exception("Run failed")
+            self._status['last_error'] = repr(e)
+            return []
+        finally:
+            done.set()
+            reporter.join()
+            self._status['state'] = 'idle'
+            self._status['last_run'] = _now()
+            self._status['last_duration'] = time.perf_counter() - start
+            self._status['runs'] += 1
+
+        # NOTE failed aggregators keep their old id, so they are retried on the next poll
+        for key in aggregated:
+            if key not in polled:
+                continue
+            self._data[key] = polled[key]
+            self._status['aggregators'][key] = {'data': polled[key], 'updated': self._status['last_run']}
+        self._write_status()
+
+        return aggregated
+
+    def _report(self, done: threading.Event) -> None:
+        while not done.wait(STATUS_INTERVAL):
+            self._write_status()
+
+    def status(self) -> dict:
+        return self._status | {'queue_length': self._manager.queue_length}
+
+    def _write_status(self) -> None:
+        tmp = f'{self._status_file}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(self.status(), indent=4))
+            os.replace(tmp, self._status_file)
+        except OSError as e:
+            logger.warning(f"Could not write status file {self._status_file}: {e}")
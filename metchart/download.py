@@ -0,0 +1,325 @@
+'''
+Download engine
+
+Fetches many files concurrently over keep-alive connections.
+Every worker thread holds its own session, requests are retried with
+exponential backoff on server errors, timeouts and dropped connections.
+
+Completed files are recorded in a manifest next to them, with size,
+checksum and the validators of the source. Interrupted transfers are
+kept as .part files and resumed with HTTP Range requests.
+Manifests are shared by all downloaders of a process and merged with
+the saved one, so other processes can use the same directory.
+'''
+from __future__ import annotations
+
+import os
+import bz2
+import json
+import time
+import hashlib
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import logging
+logger = logging.getLogger(__name__)
+
+from . import timing
+from . import cache
+
+# NOTE bytes per read from the connection
+CHUNK_SIZE = 1 << 16
+
+# NOTE network bound, so independent of the CPU count
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = 30
+DEFAULT_BACKOFF = 1.
+
+MANIFEST_FILE = 'manifest.json'
+PART_SUFFIX = '.part'
+
+_RETRY_STATUS = (500, 502, 503, 504)
+
+# NOTE key of the manifest in the lock file of its directory, runs use YYYYMMDDHH, see cache.lock()
+_MANIFEST_LOCK = 0
+
+# NOTE directory -> Manifest, shared by all downloaders
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+class DownloadException(Exception):
+    pass
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Manifest:
+    '''
+    Completed and partial downloads of one directory.
+    Entries are keyed by filename and hold size and sha256 of the stored file,
+    as well as url, etag and last_modified of the source.
+    '''
+    def __init__(self, directory: str):
+        self._filename = os.path.join(directory, MANIFEST_FILE)
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._entries = self._read()
+        # NOTE name -> entry, None if removed. Changes since the last save
+        self._changes = {}
+
+    def _read(self) -> dict:
+        if not os.path.exists(self._filename):
+            return {}
+        try:
+            with open(self._filename, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable manifest {self._filename}: {e}")
+            return {}
+
+    def _merge(self, entries: dict) -> dict:
+        for name, entry in self._changes.items():
+            if entry is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = entry
+        return entries
+
+    def get(self, name: str) -> dict | None:
+        with self._lock:
+            return self._entries.get(name)
+
+    def set(self, name: str, entry: dict) -> None:
+        with self._lock:
+            self._entries[name] = entry
+            self._changes[name] = entry
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._entries.pop(name, None)
+            self._changes[name] = None
+
+    def reload(self) -> None:
+        '''
+        Picks up entries saved by other processes, changes not saved yet are kept
+        '''
+        entries = self._read()
+        with self._lock:
+            self._entries = self._merge(entries)
+
+    def record(self, path: str, sha256: str | None = None, **source) -> None:
+        '''
+        Marks an existing file as complete
+        '''
+        self.set(os.path.basename(path), {
+            'complete': True,
+            'size': os.path.getsize(path),
+            'sha256': _sha256(path) if sha256 is None else sha256,
+        } | source)
+
+    def is_complete(self, path: str, verify: bool = False) -> bool:
+        entry = self.get(os.path.basename(path))
+        if entry is None or not entry.get('complete') or not os.path.exists(path):
+            return False
+        if os.path.getsize(path) != entry['size']:
+            return False
+        return not verify or _sha256(path) == entry['sha256']
+
+    def save(self) -> None:
+        '''
+        Writes the changes into the saved manifest, which may have been changed by others
+        '''
+        with cache.lock(self._directory, _MANIFEST_LOCK), self._lock:
+            entries = self._merge(self._read())
+            # NOTE files may have been evicted from the cache meanwhile
+            self._entries = {
+                name: entry for name, entry in entries.items()
+                    if os.path.exists(os.path.join(self._directory, name if entry.get('complete') else name + PART_SUFFIX))
+            }
+            self._changes = {}
+            tmp = f'{self._filename}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(self._entries, indent=4))
+            os.replace(tmp, self._filename)
+
+    @staticmethod
+    def of(directory: str) -> Manifest:
+        '''
+        The manifest of directory shared within this process
+        '''
+        directory = os.path.abspath(directory)
+        with _manifests_lock:
+            if directory not in _manifests:
+                _manifests[directory] = Manifest(directory)
+            return _manifests[directory]
+
+class Downloader:
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, retries: int = DEFAULT_RETRIES,
+                 timeout: float = DEFAULT_TIMEOUT, backoff: float = DEFAULT_BACKOFF,
+                 revalidate: bool = False, verify: bool = False):
+        self._concurrency = max(int(concurrency), 1)
+        self._retries = max(int(retries), 0)
+        self._timeout = timeout
+        self._backoff = backoff
+        # NOTE ask the server whether complete files changed, instead of trusting them
+        self._revalidate = revalidate
+        # NOTE compare checksums of complete files, not just their size
+        self._verify = verify
+        self._local = threading.local()
+
+    def manifest(self, directory: str) -> Manifest:
+        return Manifest.of(directory)
+
+    def is_complete(self, dest: str) -> bool:
+        return self.manifest(os.path.dirname(dest)).is_complete(dest, self._verify)
+
+    def download_all(self, files: list[tuple[str, str]], decompress: str | None = None) -> list[tuple[str, str, str]]:
+        '''
+        Fetches (url, destination) pairs, complete destinations are kept.
+        Returns (url, destination, error) of every file that could not be fetched.
+        '''
+        try:
+            with ThreadPool(min(self._concurrency, max(len(files), 1))) as pool:
+                results = pool.map(lambda f: self._download_one(*f, decompress=decompress), files)
+        finally:
+            for directory in set([os.path.dirname(dest) for _, dest in files]):
+                self.manifest(directory).save()
+
+        failed = [r for r in results if r is not None]
+        for url, dest, error in failed:
+            logger.error(f'Failed to download {url}: {error}')
+        return failed
+
+    def download(self, url: str, dest: str, decompress: str | None = None) -> int:
+        '''
+        Fetches url into dest, retrying and resuming on transient errors.
+        Returns the number of transferred bytes.
+        '''
+        received = 0
+        for attempt in range(self._retries + 1):
+            try:
+                received += self._fetch(url, dest, decompress)
+                return received
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == self._retries:
+                    raise
+                wait = self._backoff * 2 ** attempt
+                logger.warning(f'Retrying {url} in {wait:.1f}s: {e}')
+                time.sleep(wait)
+
+    def _download_one(self, url: str, dest: str, decompress: str | None) -> tuple[str, str, str] | None:
+        if self.is_complete(dest) and not self._revalidate:
+            cache.touch(dest)
+            return None
+
+        with timing.stage('download', file=os.path.basename(dest)) as t:
+            try:
+                t['bytes'] = self.download(url, dest, decompress)
+            except Exception as e:
+                return url, dest, str(e)
+        return None
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, 'session'):
+            # NOTE urllib3 only retries server errors, connection problems are retried by download()
+            retry = Retry(total=self._retries, connect=0, read=0, backoff_factor=self._backoff,
+                          status_forcelist=_RETRY_STATUS, allowed_methods=['GET'],
+                          raise_on_status=False)
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(max_retries=retry))
+            session.mount('https://', HTTPAdapter(max_retries=retry))
+            self._local.session = session
+        return self._local.session
+
+    def _fetch(self, url: str, dest: str, decompress: str | None) -> int:
+        '''
+        Streams the raw body into dest.part, resuming it if possible,
+        and moves it into place once complete.
+        '''
+        manifest = self.manifest(os.path.dirname(dest))
+        name = os.path.basename(dest)
+        part = dest + PART_SUFFIX
+        entry = manifest.get(name) or {}
+
+        headers = {}
+        if manifest.is_complete(dest, self._verify):
+            if 'etag' in entry:
+                headers['If-None-Match'] = entry['etag']
+            if 'last_modified' in entry:
+                headers['If-Modified-Since'] = entry['last_modified']
+        elif os.path.exists(part) and entry.get('url') == url and ('etag' in entry or 'last_modified' in entry):
+            # NOTE If-Range makes the server send everything, if the file changed meanwhile
+            headers['Range'] = f'bytes={os.path.getsize(part)}-'
+            headers['If-Range'] = entry.get('etag', entry.get('last_modified'))
+
+        received = 0
+        with self._session().get(url, stream=True, timeout=self._timeout, headers=headers) as r:
+            if r.status_code == 304:
+                logger.debug(f'{name} not modified')
+                cache.touch(dest)
+                return 0
+            if r.status_code == 416:
+                logger.debug(f'{name} can not be resumed, starting over')
+                os.unlink(part)
+                manifest.remove(name)
+                return self._fetch(url, dest, decompress)
+            r.raise_for_status()
+
+            source = {'url': url}
+            if 'ETag' in r.headers:
+                source['etag'] = r.headers['ETag']
+            if 'Last-Modified' in r.headers:
+                source['last_modified'] = r.headers['Last-Modified']
+
+            resume = r.status_code == 206
+            if resume:
+                logger.debug(f'Resuming {name} at {os.path.getsize(part)} bytes')
+            else:
+                manifest.set(name, {'complete': False} | source)
+
+            with open(part, 'ab' if resume else 'wb') as f:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    received += len(chunk)
+                    f.write(chunk)
+
+        manifest.record(dest, sha256=self._finish(part, dest, decompress), **source)
+        logger.debug(f'Downloaded {dest}')
+        return received
+
+    def _finish(self, part: str, dest: str, decompress: str | None) -> str:
+        '''
+        Decompresses dest.part into a temporary file, which is renamed to dest.
+        Returns the sha256 of the result.
+        '''
+        if decompress is None:
+            os.replace(part, dest)
+            return _sha256(dest)
+
+        tmp = f'{dest}.tmp'
+        h = hashlib.sha256()
+        try:
+            decompressor = bz2.BZ2Decompressor()
+            with open(part, 'rb') as src, open(tmp, 'wb') as f:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    data = decompressor.decompress(chunk)
+                    h.update(data)
+                    f.write(data)
+            if not decompressor.eof:
+                raise DownloadException(f'{os.path.basename(part)} ends before the end of the bz2 stream')
+            os.replace(tmp, dest)
+        finally:
+            # NOTE the body was complete, so a broken part can not be resumed either
+            os.unlink(part)
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return h.hexdigest()
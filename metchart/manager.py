@@ -4,15 +4,21 @@ import yaml
 import json
 import os
 
-import importlib
 import functools
+import contextlib
+import traceback
 
 import logging
 logger = logging.getLogger(__name__)
 
-from multiprocessing import cpu_count
+from multiprocessing import cpu_count, get_context
+from multiprocessing.pool import ThreadPool, AsyncResult
 
-from metchart.aggregator import DataView
+from metchart.aggregator import DataView, Dimension, AggregatorNotImplementedException, area_contains, area_contains_point
+from metchart import render_cache
+from metchart import cache as download_cache
+from metchart import timing
+from metchart import plugins
 
 class ManagerException(Exception):
     pass
@@ -28,6 +34,27 @@ def run_if_present(key, dct: dict, func: Callable, *args, **kwargs):
     if key in dct:
         func(dct[key], *args, **kwargs)
 
+def _init_worker(plotters: list) -> None:
+    for plotter in plotters:
+        plotter.warm_up()
+
+def _plot_job(plotter, view: DataView) -> tuple[str|None, str|None, dict]:
+    '''
+    Renders a single detached view. Runs in a worker process, so errors and timings
+    are returned instead of being raised or recorded.
+    '''
+    name = view.generate_unique_name()
+    with timing.stage('plot', record=False, plotter=plotter._name, view=name, chain=view.generate_chain()) as t:
+        try:
+            # NOTE lazy data is read here, only the selection of this view
+            view.get().load()
+            filename = plotter.plot(view, name)
+            if filename:
+                t['bytes'] = os.path.getsize(os.path.join(plotter._output_dir, filename))
+            return filename, None, t
+        except Exception:
+            return None, traceback.format_exc(), t
+
 
 class Index:
     '''
@@ -64,6 +91,10 @@ class Index:
         self._sub_indices[sub_name].append({'file': filename, 'display_name': display_name})
 
     def save(self):
+        with timing.stage('index'):
+            self._save()
+
+    def _save(self):
         index = [{ 'name': sub,
                    'indexfile': f'{sub}.index.json',
                    'list_title': self._sub_type[sub] }
@@ -78,7 +109,7 @@ class Index:
 
 
 class Manager:
-    def __init__(self, filename: str = 'metchart.yaml'):
+    def __init__(self, filename: str = 'metchart.yaml', trace: str | None = None):
         logger.info( "Preparing Manager")
 
         self.aggregators={}
@@ -88,10 +119,21 @@ class Manager:
         self._output_dir = './metchar_output'
         self._thread_count = max(cpu_count()-1, 1)
         self._cache_dir = './metchart_cache'
+        self._render_cache = True
+        self._trace_file = None
+        self._pool = None
+        # NOTE no limits, only orphaned indices are removed
+        self._cache_limits = {}
+
+        # NOTE number of submitted views that are not rendered yet
+        self.queue_length = 0
 
         self._load()
         self._parse()
 
+        if trace is not None:
+            self._trace_file = trace
+
         if not os.path.exists(self._output_dir):
             logger.debug("Creating OUTPUT dir {self._output_dir}")
             os.makedirs(self._output_dir)
@@ -99,30 +141,322 @@ class Manager:
             logger.debug("Creating CACHE  dir {self._cache_dir}")
             os.makedirs(self._cache_dir)
 
-    def run_plotters(self):
-        logger.info( "Running plotters")
+    def run(self, aggregators: list[str] | None = None) -> list[str]:
+        '''
+        Aggregates and plots in one go.
+        Aggregators run concurrently and plotting for an aggregator starts
+        as soon as its data is ready.
+        If aggregators is given, only those are aggregated again,
+        the others are plotted from the data they already hold.
+        Returns the aggregators that were aggregated successfully.
+        '''
+        logger.info("Running pipeline")
+        timing.reset()
+
+        needed = self._collect_needed()
+
+        to_aggregate = [
+            key for key in self.aggregators
+                if aggregators is None or key in aggregators or self.aggregators[key]._dataset is None
+        ]
 
         index = Index(self._output_dir)
+        cache = render_cache.RenderCache(self._cache_dir, self._output_dir) if self._render_cache else None
+        jobs = {}
+        aggregated = []
+
+        # NOTE the plot pool has to be forked before any aggregator thread is started
+        with self._plot_pool() as pool:
+            for agg in self.aggregators:
+                if agg in to_aggregate:
+                    continue
+                for key in self._plotters_for(agg):
+                    jobs[key] = self._start_plot_jobs(key, pool, cache)
+
+            with ThreadPool(max(len(to_aggregate), 1)) as agg_pool:
+                for agg, ok in agg_pool.imap_unordered(functools.partial(self._aggregate_one, needed), to_aggregate):
+                    if ok:
+                        aggregated.append(agg)
+                    elif self.aggregators[agg]._dataset is None:
+                        continue
+                    else:
+                        # NOTE e.g. in daemon mode, the plots of the previous data are kept in the index
+                        logger.warning(f"Aggregator {agg}: plotting the data aggregated before")
+
+                    for key in self._plotters_for(agg):
+                        jobs[key] = self._start_plot_jobs(key, pool, cache)
+
+            self._finish_plot_jobs([j for key in self.plotters if key in jobs for j in jobs[key]], index, cache)
+
+        # NOTE only after rendering, workers read lazily from stores in the cache
+        self.clean_cache()
+
+        skipped = [key for key in self.plotters if key not in jobs]
+        if len(skipped) > 0:
+            logger.error(f"Plotters without data: {skipped}")
+
+        timing.save(os.path.join(self._output_dir, 'timings.json'))
+        if self._trace_file is not None:
+            timing.save_trace(self._trace_file)
+            logger.info(f"Trace written to {self._trace_file}")
+
+        return aggregated
+
+    def plan(self) -> dict:
+        '''
+        Lists all files that would be fetched and all views that would be plotted,
+        without downloading, loading or rendering anything.
+        '''
+        logger.info("Planning")
+
+        needed = self._collect_needed()
+        cache = render_cache.RenderCache(self._cache_dir, self._output_dir) if self._render_cache else None
+
+        plan = {'aggregators': {}, 'plotters': {}}
+        datasets = {}
+
+        for key in self.aggregators:
+            agg = self.aggregators[key]
+            for n in needed[key]:
+                agg.add_needed(n)
+
+            try:
+                agg_plan = agg.plan()
+            except AggregatorNotImplementedException:
+                logger.warning(f"Aggregator {key} can not be planned")
+                continue
+
+            datasets[key] = agg_plan['dataset']
+            to_fetch = [f for f in agg_plan['files'] if not f['cached']]
+            plan['aggregators'][key] = {
+                'files': len(agg_plan['files']),
+                'cached': len(agg_plan['files']) - len(to_fetch),
+                'estimated_bytes': sum([f['bytes'] for f in to_fetch if f['bytes'] is not None]),
+                'unknown_size': len([f for f in to_fetch if f['bytes'] is None]),
+                'fetch': [f['source'] for f in to_fetch],
+            }
 
         for key in self.plotters:
-            cfg = self.plotters[key]['config']
+            agg = self.plotters[key]['config'].get('aggregator')
+            if agg not in datasets:
+                continue
             plt = self.plotters[key]['object']
 
-            full_view = DataView(self.aggregators[cfg['aggregator']]._dataset, name=key)
+            files = []
+            cached = 0
+            for view in self._generate_views(key, datasets[agg]):
+                files.append(plt.output_filename(view.generate_unique_name()))
+
+                if cache is not None and self.aggregators[agg].fingerprint() is not None:
+                    if cache.lookup(view.generate_unique_name(), self._fingerprint_job(key, view)) is not None:
+                        cached += 1
+
+            plan['plotters'][key] = {'views': len(files), 'cached': cached, 'outputs': files}
+
+        return plan
+
+    def run_plotters(self):
+        logger.info( "Running plotters")
+
+        index = Index(self._output_dir)
+        cache = render_cache.RenderCache(self._cache_dir, self._output_dir) if self._render_cache else None
+
+        with self._plot_pool() as pool:
+            jobs = []
+            for agg in self.aggregators:
+                for key in self._plotters_for(agg):
+                    jobs.extend(self._start_plot_jobs(key, pool, cache))
+
+            jobs.sort(key=lambda j: list(self.plotters).index(j['key']))
+            self._finish_plot_jobs(jobs, index, cache)
+
+    def start_workers(self) -> None:
+        '''
+        Starts plot workers that are kept across runs, until stop_workers() is called.
+        '''
+        if self._pool is None and self._thread_count > 1:
+            self._pool = self._new_pool()
+
+    def stop_workers(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _plot_pool(self):
+        if self._pool is not None:
+            return contextlib.nullcontext(self._pool)
+        if self._thread_count < 2:
+            return contextlib.nullcontext(None)
+        return self._new_pool()
+
+    def _new_pool(self):
+        # NOTE fork, so workers inherit the registered units and colormaps
+        return get_context('fork').Pool(self._thread_count,
+                                        initializer=_init_worker,
+                                        initargs=([self.plotters[key]['object'] for key in self.plotters],))
+
+    def _plotters_for(self, aggregator: str) -> list[str]:
+        return [key for key in self.plotters if self.plotters[key]['config'].get('aggregator') == aggregator]
+
+    def _start_plot_jobs(self, key: str, pool, cache: render_cache.RenderCache | None) -> list[dict]:
+        '''
+        Renders all views of a plotter, either directly or by submitting them to pool.
+        Cached views are not rendered again.
+        '''
+        plt = self.plotters[key]['object']
+
+        jobs = []
+        try:
+            for view in self._generate_views(key):
+                job = {'key': key, 'view': view, 'fingerprint': None, 'result': None}
+                jobs.append(job)
+
+                # NOTE a view that can not be prepared fails on its own, like one that can not be rendered
+                try:
+                    if cache is not None:
+                        job['fingerprint'] = self._fingerprint_job(key, view)
+                        cached = cache.lookup(view.generate_unique_name(), job['fingerprint'])
+                        if cached is not None:
+                            job['result'] = (cached, None, None)
+                except Exception:
+                    job['result'] = (None, traceback.format_exc(), None)
+        except Exception:
+            logger.exception(f"{key}: generating views failed, {len(jobs)} views are rendered")
+
+        pending = [j for j in jobs if j['result'] is None]
+        logger.info(f"{key}: rendering {len(pending)} of {len(jobs)} views")
+        self.queue_length += len(pending)
+
+        for job in pending:
+            try:
+                view = job['view'].detach()
+            except Exception:
+                job['result'] = (None, traceback.format_exc(), None)
+                self.queue_length -= 1
+                continue
+
+            if pool is None:
+                job['result'] = _plot_job(plt, view)
+                self.queue_length -= 1
+            else:
+                job['result'] = pool.apply_async(_plot_job, (plt, view))
+
+        return jobs
+
+    def _finish_plot_jobs(self, jobs: list[dict], index: Index, cache: render_cache.RenderCache | None):
+        failed = 0
+        for job in jobs:
+            result = job['result']
+            if isinstance(result, AsyncResult):
+                result = result.get()
+                self.queue_length -= 1
+            real_filename, error, t = result
+            if t is not None:
+                timing.add(t)
+
+            if error is not None:
+                failed += 1
+                logger.error(f"{job['key']}: failed to plot {job['view'].generate_unique_name()}\n{error}")
+                continue
 
-            for query_view in full_view.for_queries(cfg['for_queries'] if 'for_queries' in cfg else []):
-                for along_view in query_view.along_dimensions(cfg['along_dimensions'] if 'along_dimensions' in cfg else []):
-                    real_filename = plt.plot(along_view, along_view.generate_unique_name() )
+            index.add_object(real_filename, job['view'].generate_chain())
+            if cache is not None:
+                cache.store(job['view'].generate_unique_name(), job['fingerprint'], real_filename)
 
-                    index.add_object(real_filename, along_view.generate_chain())
+        if failed > 0:
+            logger.error(f"{failed} of {len(jobs)} views failed to plot")
 
         index.save()
+        if cache is not None:
+            cache.save()
+
+    def _fingerprint_job(self, key: str, view: DataView) -> str:
+        cfg = self.plotters[key]['config']
+        plt = self.plotters[key]['object']
+
+        data = self.aggregators[cfg['aggregator']].fingerprint()
+        if data is None:
+            data = render_cache.hash_dataset(view.get())
+        else:
+            # NOTE e.g. steps added to a run, only views covering them are rendered again.
+            # The grid is part of the aggregator fingerprint, queried coordinates are part of the chain.
+            dataset = [d for d in view._get_attr_from_parents('_dataset') if d is not None][-1]
+            queried = [str(k) for element in view.generate_chain() for k in element.get('query', {})]
+            data = [data, render_cache.hash_coords(dataset, queried + [Dimension.LATITUDE, Dimension.LONGITUDE])]
+
+        return render_cache.fingerprint(
+            key, type(plt).__module__, type(plt).__qualname__,
+            cfg['config'], view.generate_chain(), data
+        )
+
+    def _generate_views(self, key: str, dataset = None):
+        cfg = self.plotters[key]['config']
+
+        if dataset is None:
+            dataset = self.aggregators[cfg['aggregator']]._dataset
+        full_view = DataView(dataset, name=key)
 
+        for query_view in full_view.for_queries(cfg['for_queries'] if 'for_queries' in cfg else []):
+            for along_view in query_view.along_dimensions(cfg['along_dimensions'] if 'along_dimensions' in cfg else []):
+                yield along_view
 
     def aggregate_data(self):
         logger.info( "Aggregating data")
 
-        needed = {}
+        needed = self._collect_needed()
+
+        for key in self.aggregators:
+            logger.debug(f"Aggregator {key} collecting data")
+            agg = self.aggregators[key]
+            for n in needed[key]:
+                agg.add_needed(n)
+            agg.aggregate()
+
+        logger.info("Aggregation finished")
+        self.clean_cache()
+
+    def clean_cache(self) -> None:
+        '''
+        Evicts cached downloads exceeding the configured limits
+        '''
+        with timing.stage('cache') as t:
+            try:
+                c = download_cache.Cache(self._cache_dir, **self._cache_limits)
+                t['bytes'] = c.clean({ agg.cache_directory(): agg.run_of for agg in self.aggregators.values() },
+                                     protected=set([(agg.cache_directory(), run)
+                                                    for agg in self.aggregators.values() for run in agg.runs_in_use()]))
+            except OSError:
+                logger.exception("Cleaning the cache failed")
+                return
+        if t['bytes'] > 0:
+            logger.info(f"Freed {t['bytes'] / 1e6:.1f} MB of cache")
+
+    def _aggregate_one(self, needed: dict, key: str) -> tuple[str, bool]:
+        logger.debug(f"Aggregator {key} collecting data")
+        try:
+            agg = self.aggregators[key]
+            for n in needed[key]:
+                agg.add_needed(n)
+            agg.aggregate()
+        except Exception:
+            logger.exception(f"Aggregator {key} failed")
+            return key, False
+
+        logger.info(f"Aggregator {key} finished")
+        return key, True
+
+    def register_needed(self) -> None:
+        '''
+        Tells every aggregator which variables its plotters need
+        '''
+        needed = self._collect_needed()
+        for key in self.aggregators:
+            for n in needed[key]:
+                self.aggregators[key].add_needed(n)
+
+    def _collect_needed(self) -> dict:
+        needed = { key: [] for key in self.aggregators }
 
         for key in self.plotters:
             logger.debug(f"Building requirements list for plotter {key}")
@@ -136,19 +470,9 @@ class Manager:
             if agg not in self.aggregators:
                 raise ManagerAggregatorNotFoundException(agg)
 
-            if agg not in needed:
-                needed[agg] = []
-
             needed[agg].extend(plt.report_needed_variables())
 
-        for key in self.aggregators:
-            logger.debug(f"Aggregator {key} collecting data")
-            agg = self.aggregators[key]
-            for n in needed[key]:
-                agg.add_needed(n)
-            agg.aggregate()
-
-        logger.info("Aggregation finished")
+        return needed
 
     def _aggregator_callback(self, caller_name: str):
         if caller_name not in self.plotters:
@@ -168,14 +492,56 @@ class Manager:
     def _parse(self):
         run_if_present('output', self._raw_config, self._parse_output)
         run_if_present('thread_count', self._raw_config, self._parse_thread_count)
+        run_if_present('render_cache', self._raw_config, self._parse_render_cache)
+        run_if_present('trace', self._raw_config, self._parse_trace)
+        run_if_present('cache', self._raw_config, self._parse_cache)
 
         run_if_present('aggregator', self._raw_config, self._parse_module, self._load_aggregator)
         # TODO reactivate
         #run_if_present('modifier', self._raw_config, self._parse_module, self._load_modifier)
 
         run_if_present('plotter', self._raw_config, self._parse_module, self._prepare_plotter)
+        self._check_areas()
+        self._register_points()
         logger.debug("Config loaded OK")
 
+    def _check_areas(self):
+        '''
+        Plot areas and query points have to lie within the area their aggregator is cropped to
+        '''
+        for key in self.plotters:
+            cfg = self.plotters[key]['config']
+            if cfg.get('aggregator') not in self.aggregators:
+                continue
+            area = self.aggregators[cfg['aggregator']].area()
+            if area is None:
+                continue
+
+            plot_area = self.plotters[key]['object'].area()
+            if plot_area is not None and not area_contains(area, plot_area):
+                raise ManagerException(f"{key}: area {plot_area} exceeds the area {area} of {cfg['aggregator']}")
+
+            for query in cfg.get('for_queries', []):
+                q = query.get('query', {})
+                if 'latitude' in q and 'longitude' in q and not area_contains_point(area, q['latitude'], q['longitude']):
+                    raise ManagerException(f"{key}: {query.get('name')} lies outside the area {area} of {cfg['aggregator']}")
+
+    def _register_points(self):
+        '''
+        Tells aggregators extracting points which points their plotters query.
+        Those can only serve plotters which query points.
+        '''
+        for key in self.plotters:
+            cfg = self.plotters[key]['config']
+            if cfg.get('aggregator') not in self.aggregators or not self.aggregators[cfg['aggregator']].extracts_points():
+                continue
+
+            queries = [query.get('query', {}) for query in cfg.get('for_queries', [])]
+            if len(queries) < 1 or not all(['latitude' in q and 'longitude' in q for q in queries]):
+                raise ManagerException(f"{key}: {cfg['aggregator']} only extracts points, every query needs latitude and longitude")
+            for q in queries:
+                self.aggregators[cfg['aggregator']].add_point(q['latitude'], q['longitude'])
+
     def _parse_module(self, data: dict, then: Callable):
         for key in data:
             cfg = data[key]
@@ -184,9 +550,7 @@ class Manager:
                 logger.error(f'{key} is missing the "module" keyword. Config is ignored')
                 continue
 
-            modname, classname = cfg['module'].rsplit('.',1)
-            module = importlib.import_module(modname)
-            class_obj = getattr(module,classname)
+            class_obj = plugins.resolve(cfg['module'])
 
             then(key, class_obj, cfg)
 
@@ -216,5 +580,15 @@ class Manager:
     def _parse_output(self, data: str):
         self._output_dir = data
     def _parse_thread_count(self, data: int):
-        logger.warning("thread_count is set but will not be used.")
-        self._thread_count = data
+        self._thread_count = max(int(data), 1)
+    def _parse_render_cache(self, data: bool):
+        self._render_cache = bool(data)
+    def _parse_trace(self, data: str):
+        self._trace_file = data
+    def _parse_cache(self, data: dict):
+        if 'max_bytes' in data:
+            self._cache_limits['max_bytes'] = download_cache.parse_size(data['max_bytes'])
+        if 'max_runs' in data:
+            self._cache_limits['max_runs'] = int(data['max_runs'])
+        if 'max_age' in data:
+            self._cache_limits['max_age'] = float(data['max_age'])
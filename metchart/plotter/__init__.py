@@ -23,6 +23,13 @@ class Plotter:
         self._init()
         logger.debug(f"{self._name}: init")
 
+    def __getstate__(self):
+        # NOTE the callback is bound to the Manager and would drag every dataset
+        # along when the plotter is sent to a worker process
+        state = self.__dict__.copy()
+        state['_aggregator_callback'] = None
+        return state
+
     def load_config(self, *args, **kwargs) -> None:
         self._load_config(*args, **kwargs)
         logger.debug(f"{self._name}: config loaded")
@@ -36,9 +43,37 @@ class Plotter:
         logger.debug(f"{self._name}: plotting")
         return self._plot(view, filename_prefix)
 
+    def output_filename(self, filename_prefix: str) -> str:
+        '''
+        Filename plot() will produce for filename_prefix, relative to self._output_dir
+        '''
+        return self._output_filename(filename_prefix)
+
+    def area(self) -> tuple | None:
+        '''
+        (west, east, south, north) the plots cover, None if not fixed
+        '''
+        return self._area()
+
+    def warm_up(self) -> None:
+        '''
+        Loads everything needed for plotting ahead of time.
+        Called once per worker process, before any view is plotted.
+        '''
+        self._warm_up()
+
     def _init(self):
         pass
 
+    def _warm_up(self):
+        import matplotlib.pyplot
+
+    def _area(self) -> tuple | None:
+        return None
+
+    def _output_filename(self, filename_prefix: str) -> str:
+        return f'{filename_prefix}.png'
+
     'to implement'
     def _load_config(self, *args, **kwargs) -> None:
         raise PlotterNotImplementedException('_load_config()')
@@ -63,6 +98,9 @@ class DebugPlotter(Plotter):
     def _report_needed_variables(self) -> list[Variable]:
         return [ Variable(v) for v in self._needed ]
 
+    def _output_filename(self, filename_prefix: str) -> str:
+        return ''
+
     def _plot(self, view, filename_prefix: str) -> str:
         print(view.get())
         return ''
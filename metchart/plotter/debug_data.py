@@ -11,5 +11,8 @@ class Debug (Plotter):
     def _report_needed_variables(self) -> list[Variable]:
         return []
 
+    def _output_filename(self, filename_prefix: str) -> str:
+        return ''
+
     def _plot(self, view: DataView, filename_prefix: str):
         print(view.get())
@@ -1,8 +1,6 @@
 from metchart.plotter import Plotter
 from metchart.aggregator import Variable, Dimension
 
-import matplotlib.pyplot as plt
-
 import os
 
 import logging
@@ -25,6 +23,8 @@ class GraphPlotter(Plotter):
         return self._vars
 
     def _plot(self, view, filename_prefix: str) -> str:
+        import matplotlib.pyplot as plt
+
         ds = view.get()
 
         fig = plt.figure()
@@ -5,8 +5,6 @@ import json
 import xarray as xr
 
 import numpy as np
-import matplotlib.pyplot as plt
-from metpy.plots import MapPanel, PanelContainer, RasterPlot, ContourPlot, BarbPlot
 
 from .. import misc
 
@@ -22,6 +20,8 @@ plotter:
       layers:
         - layertype: raster
           field: u_surface
+      # optional, [west, east, south, north] or a MetPy area name
+      area: [8.9, 13.9, 47.2, 50.6]
     along_dimensions:
       - time
 '''
@@ -30,8 +30,9 @@ class HorizontalPlotter (Plotter):
     def _init(self):
         self._plot_configs = {}
 
-    def _load_config(self, layers: list):
+    def _load_config(self, layers: list, area: list | str | None = None):
         self._layer_configs = layers
+        self._map_area = tuple(area) if isinstance(area, list) else area
 
     def _report_needed_variables(self) -> list[Variable]:
         ret = []
@@ -43,10 +44,22 @@ class HorizontalPlotter (Plotter):
                 ret.append(Variable(layer['field'].lower()))
         return ret
 
+    def _warm_up(self):
+        import matplotlib.pyplot
+        import metpy.plots
+
+    def _area(self) -> tuple | None:
+        # NOTE named MetPy areas can not be checked
+        return self._map_area if isinstance(self._map_area, tuple) else None
+
     def _plot(self, view: DataView, filename_prefix: str):
-        return _plot(view.get(), self._output_dir, filename_prefix, self._layer_configs)
+        return _plot(view.get(), self._output_dir, filename_prefix, self._layer_configs, self._map_area)
 
 def _plot(data, output, name, layers, area = None):
+    # NOTE deferred, metpy.plots pulls in cartopy
+    import matplotlib.pyplot as plt
+    from metpy.plots import MapPanel, PanelContainer
+
     index = []
 
     this_step = data
@@ -87,6 +100,8 @@ def _plot(data, output, name, layers, area = None):
     return outname
 
 def _layer(data, layertype, **kwargs):
+    from metpy.plots import RasterPlot, ContourPlot, BarbPlot
+
     layertypes={
         'raster': {
             'obj': RasterPlot,
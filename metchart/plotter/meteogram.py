@@ -4,10 +4,6 @@ import json
 
 import numpy as np
 
-import matplotlib.pyplot as plt
-
-import metpy.calc as mpcalc
-
 from ..aggregator import Variable, Dimension, DataView
 from . import Plotter
 
@@ -31,6 +27,10 @@ class Meteogram(Plotter):
             Variable.CONVECTION_WET_TOP, Variable.CONVECTION_WET_BASE,
         ]
 
+    def _warm_up(self):
+        import matplotlib.pyplot
+        import metpy.calc
+
     def _plot(self, view, filename_prefix):
         return _plot(view.get(), self._output_dir, filename_prefix)
 
@@ -40,6 +40,8 @@ def _get_next_subplot(size, counter=0):
     return counter, ret
 
 def _add_cloudcov(ax, data):
+    import matplotlib.pyplot as plt
+
     ax.set_ylabel('Pressure level [hPa]')
 
     clc = ax.contourf(data[Dimension.TIME], data[Dimension.PRESSURE], data[Variable.CLOUDCOVER_3D].transpose(), cmap='clcov', vmin=0, vmax=100, levels=9)
@@ -60,6 +62,8 @@ def _add_cloudcov(ax, data):
     ax.invert_yaxis()
 
 def _add_temp_dewpoint(ax, data):
+    import metpy.calc as mpcalc
+
     ### Temp + Dewpoint
     ax.plot(data[Dimension.TIME], data[Variable.TEMPERATURE_SURFACE].metpy.convert_units('degC').transpose(), color='red', label='Temperature (2m)')
     ax.plot(data[Dimension.TIME], mpcalc.dewpoint_from_relative_humidity(data[Variable.TEMPERATURE_SURFACE], data[Variable.HUMIDITY_SURFACE]).transpose(), color='blue', label='Dewpoint (2m)')
@@ -93,6 +97,8 @@ def _add_precip(ax, data):
     ax_p.plot(data[Dimension.TIME], data[Variable.SNOW_DEPTH].transpose(), color='blue')
 
 def _add_surface_wind(ax, data):
+    import metpy.calc as mpcalc
+
     ax.plot(data[Dimension.TIME],
             mpcalc.wind_speed(data[Variable.U_SURFACE].transpose(), data[Variable.V_SURFACE].transpose()),
             color='black', label='Wind (10m)')
@@ -111,6 +117,9 @@ def _add_surface_wind(ax, data):
     ax.legend(loc='lower right')
 
 def _plot(data, output, name):
+    # NOTE plotting imports are deferred to keep startup fast
+    import matplotlib.pyplot as plt
+
     fig = plt.figure(figsize=(12, 12), layout="constrained")
 
     sp_cnt, spec = _get_next_subplot(4)
@@ -4,23 +4,21 @@ import os
 import datetime
 import json
 
-import matplotlib.pyplot as plt
-
 import xarray as xr
-from metpy.units import units
-import metpy.calc as mpcalc
 import numpy as np
 
-from .. import skewt
 from .. import misc
 
+import logging
+logger = logging.getLogger(__name__)
+
 from . import Plotter
 from ..aggregator import Variable, Dimension, DataView
 
 
 class Skewt(Plotter):
     def _load_config(self, **kwargs):
-        print(kwargs)
+        logger.debug(f'Skewt: config {kwargs}')
         self._cfg = kwargs
 
     def _report_needed_variables(self) -> list[Variable]:
@@ -30,10 +28,21 @@ class Skewt(Plotter):
             Variable.HUMIDITY_3D,
         ]
 
+    def _warm_up(self):
+        from .. import skewt
+        import metpy.calc
+
     def _plot(self, view, filename_prefix):
         return _plot(view.get(), self._output_dir, filename_prefix)
 
 def _plot(data, output, name, analysis=None):
+    # NOTE plotting imports are deferred to keep startup fast
+    import matplotlib.pyplot as plt
+    from metpy.units import units
+    import metpy.calc as mpcalc
+
+    from .. import skewt
+
     p = data[Dimension.PRESSURE].values * units.hPa
     T = data[Variable.TEMPERATURE_3D].values * units.K
     relHum = data[Variable.HUMIDITY_3D].values * units.percent
@@ -0,0 +1,40 @@
+'''
+Plugin registry
+
+Resolves the `module` strings of the config to classes.
+Modules are only imported once a plugin is actually resolved,
+so unused plugins never add to startup time.
+'''
+import importlib
+import functools
+
+# NOTE short names for the bundled plugins. Full paths work as well.
+ALIASES = {
+    'dwd_icon': 'metchart.aggregator.dwd_icon.IconAggregator',
+    'netcdf': 'metchart.aggregator.netcdf.NetCDFAggregator',
+    'wyoming_sounding': 'metchart.aggregator.wyoming_sounding.WyomingSoundingAggregator',
+
+    'horizontal': 'metchart.plotter.horizontal.HorizontalPlotter',
+    'meteogram': 'metchart.plotter.meteogram.Meteogram',
+    'skewt': 'metchart.plotter.skewt.Skewt',
+    'graph': 'metchart.plotter.graph.GraphPlotter',
+    'debug': 'metchart.plotter.DebugPlotter',
+}
+
+class PluginNotFoundException(Exception):
+    pass
+
+@functools.cache
+def resolve(path: str) -> type:
+    path = ALIASES.get(path, path)
+
+    if '.' not in path:
+        raise PluginNotFoundException(f'{path} is neither a known plugin nor a module path')
+
+    modname, classname = path.rsplit('.', 1)
+    module = importlib.import_module(modname)
+
+    if not hasattr(module, classname):
+        raise PluginNotFoundException(f'{modname} does not define {classname}')
+
+    return getattr(module, classname)
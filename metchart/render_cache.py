@@ -0,0 +1,86 @@
+'''
+Render cache
+
+Remembers a fingerprint for every rendered view, so unchanged views
+do not have to be plotted again on the next run.
+'''
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+from typing import Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+import logging
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = 'render_cache.json'
+
+def fingerprint(*parts) -> str:
+    '''
+    Hashes arbitrary json serializable parts into a hex digest
+    '''
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def hash_dataset(ds: xr.Dataset) -> str:
+    '''
+    Hashes values and coordinates of a dataset.
+    Used as fallback if an aggregator can not identify its data itself.
+    '''
+    h = hashlib.sha256()
+    for name in sorted(map(str, ds.variables)):
+        h.update(name.encode())
+        h.update(ds.variables[name].values.tobytes())
+    return h.hexdigest()
+
+def hash_coords(ds: xr.Dataset, exclude: Iterable[str] = ()) -> str:
+    '''
+    Hashes the indexed coordinates of a dataset, except those in exclude.
+    Tells apart views of data which only grew along some dimension.
+    '''
+    h = hashlib.sha256()
+    for name in sorted(map(str, ds.indexes)):
+        if name in exclude:
+            continue
+        h.update(name.encode())
+        h.update(ds.indexes[name].values.tobytes())
+    return h.hexdigest()
+
+class RenderCache:
+    def __init__(self, cache_dir: str, output_dir: str):
+        self._filename = os.path.join(cache_dir, CACHE_FILE)
+        self._output_dir = output_dir
+        self._entries = {}
+
+        if os.path.exists(self._filename):
+            try:
+                with open(self._filename, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable render cache {self._filename}: {e}")
+
+    def lookup(self, key: str, fp: str) -> str | None:
+        '''
+        Returns the filename of a previous rendering of key,
+        if it was made with the same fingerprint and still exists.
+        '''
+        entry = self._entries.get(key)
+        if entry is None or entry['fingerprint'] != fp:
+            return None
+        # NOTE plotters without output file, e.g. debug, are always run
+        if entry['file'] == '' or not os.path.exists(os.path.join(self._output_dir, entry['file'])):
+            return None
+        return entry['file']
+
+    def store(self, key: str, fp: str, filename: str) -> None:
+        self._entries[key] = {'fingerprint': fp, 'file': filename}
+
+    def save(self) -> None:
+        tmp = f'{self._filename}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(self._entries, indent=4))
+        os.replace(tmp, self._filename)
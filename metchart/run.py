@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 
-import sys
-import matplotlib as mpl
+import argparse
+import json
 
 import logging
 
 from . import customization
 from . import manager
+from . import timing
 
 def main():
     logging.basicConfig(level=logging.DEBUG,
@@ -20,18 +21,42 @@ def main():
     logging.getLogger('gribapi').setLevel(logging.WARNING)
     logging.getLogger('metpy').setLevel(logging.WARNING)
 
+    parser = argparse.ArgumentParser(description='declarative weather chart plotter')
+    parser.add_argument('config', nargs='?', default='examples/config.yaml')
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help='write a Trace Event Format file of the run')
+    parser.add_argument('--plan', action='store_true',
+                        help='only list files to fetch and plots to create')
+    parser.add_argument('--daemon', action='store_true',
+                        help='stay resident and render whenever new data is available')
+    parser.add_argument('--interval', type=float, default=300,
+                        help='seconds between polls in daemon mode')
+    parser.add_argument('--status', metavar='FILE', default=None,
+                        help='status file of the daemon, defaults to status.json in the output directory')
+    args = parser.parse_args()
+
+    # NOTE imported here, the backend has to be selected before pyplot is loaded,
+    # which plotter modules do when the manager creates them
+    import matplotlib as mpl
     mpl.use('agg')
 
+    cfg = manager.Manager(args.config, trace=args.trace)
+
+    if args.plan:
+        print(json.dumps(cfg.plan(), indent=4))
+        return
+
     customization.register_units()
     customization.register_colormaps()
 
-    FILE = 'examples/config.yaml'
-    if len(sys.argv) > 1:
-        FILE = sys.argv[1]
+    if args.daemon:
+        from . import daemon
+        daemon.Daemon(cfg, interval=args.interval, status_file=args.status).run_forever()
+        return
+
+    cfg.run()
 
-    cfg = manager.Manager(FILE)
-    cfg.aggregate_data()
-    cfg.run_plotters()
+    print(timing.summary())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,218 @@
+'''
+Synthetic data
+
+Generates local stand-ins for the supported data sources,
+so aggregators and plotters can be exercised without network access.
+'''
+import os
+import csv
+import datetime
+
+import numpy as np
+import xarray as xr
+
+from .aggregator import Variable, Dimension
+
+# NOTE (shortName, typeOfLevel, level) as understood by ecCodes.
+# DWD local parameters (convection, CAPE/CIN, gusts) have no standard shortName and are not supported.
+GRIB_PARAMETERS = {
+    Variable.TEMPERATURE_3D: ('t', 'isobaricInhPa', None),
+    Variable.HUMIDITY_3D: ('r', 'isobaricInhPa', None),
+    Variable.GEOPOTENTIAL: ('z', 'isobaricInhPa', None),
+    Variable.U_3D: ('u', 'isobaricInhPa', None),
+    Variable.V_3D: ('v', 'isobaricInhPa', None),
+    Variable.CLOUDCOVER_3D: ('ccl', 'isobaricInhPa', None),
+    Variable.TEMPERATURE_SURFACE: ('2t', 'heightAboveGround', 2),
+    Variable.HUMIDITY_SURFACE: ('2r', 'heightAboveGround', 2),
+    Variable.U_SURFACE: ('10u', 'heightAboveGround', 10),
+    Variable.V_SURFACE: ('10v', 'heightAboveGround', 10),
+    Variable.PRESSURE_SEA_LEVEL: ('prmsl', 'meanSea', 0),
+    Variable.PRECIPITATION_ACCUMULATED: ('tp', 'surface', 0),
+    Variable.SNOW_DEPTH: ('sde', 'surface', 0),
+}
+
+# NOTE value range and units per variable, roughly realistic so MetPy calculations work
+_VARIABLE_RANGES = {
+    Variable.TEMPERATURE_3D: (220., 300., 'K'),
+    Variable.TEMPERATURE_SURFACE: (270., 300., 'K'),
+    Variable.HUMIDITY_3D: (10., 100., 'percent'),
+    Variable.HUMIDITY_SURFACE: (30., 100., 'percent'),
+    Variable.GEOPOTENTIAL: (1000., 100000., 'm**2 s**-2'),
+    Variable.U_3D: (-30., 30., 'm s**-1'),
+    Variable.V_3D: (-30., 30., 'm s**-1'),
+    Variable.U_SURFACE: (-10., 10., 'm s**-1'),
+    Variable.V_SURFACE: (-10., 10., 'm s**-1'),
+    Variable.GUST_SURFACE: (0., 25., 'm s**-1'),
+    Variable.CLOUDCOVER_3D: (0., 100., 'percent'),
+    Variable.PRECIPITATION_ACCUMULATED: (0., 5., 'kg m**-2'),
+    Variable.SNOW_DEPTH: (0., 0.5, 'm'),
+    Variable.CONVECTION_WET_BASE: (500., 2000., 'm'),
+    Variable.CONVECTION_WET_TOP: (3000., 9000., 'm'),
+    Variable.CONVECTION_DRY_TOP: (1000., 3000., 'm'),
+    Variable.PRESSURE_SEA_LEVEL: (98000., 104000., 'Pa'),
+    Variable.CAPE: (0., 2000., 'J kg**-1'),
+    Variable.CIN: (-200., 0., 'J kg**-1'),
+}
+
+_3D = [
+    Variable.TEMPERATURE_3D, Variable.HUMIDITY_3D, Variable.GEOPOTENTIAL,
+    Variable.U_3D, Variable.V_3D, Variable.CLOUDCOVER_3D,
+]
+
+def _random(var: Variable, shape, rng: np.random.Generator) -> np.ndarray:
+    low, high, _ = _VARIABLE_RANGES[var]
+    return rng.uniform(low, high, shape)
+
+def write_grib(path: str, var: Variable, init: datetime.datetime, step: int,
+               level: int | None = None, nlat: int = 657, nlon: int = 1377,
+               area: tuple = (-23.5, 62.5, 29.5, 70.5), seed: int = 0) -> None:
+    '''
+    Writes a single GRIB2 message like the ones on the DWD OpenData server.
+    area is (west, east, south, north).
+    '''
+    import eccodes
+
+    short_name, level_type, fixed_level = GRIB_PARAMETERS[var]
+    sample = 'regular_ll_pl_grib2' if level_type == 'isobaricInhPa' else 'regular_ll_sfc_grib2'
+    west, east, south, north = area
+
+    gid = eccodes.codes_grib_new_from_samples(sample)
+    try:
+        eccodes.codes_set(gid, 'centre', 'edzw')
+        eccodes.codes_set(gid, 'dataDate', int(init.strftime('%Y%m%d')))
+        eccodes.codes_set(gid, 'dataTime', int(init.strftime('%H%M')))
+        eccodes.codes_set(gid, 'typeOfLevel', level_type)
+        eccodes.codes_set(gid, 'level', level if fixed_level is None else fixed_level)
+        eccodes.codes_set(gid, 'shortName', short_name)
+        eccodes.codes_set(gid, 'stepUnits', 1)
+        eccodes.codes_set(gid, 'forecastTime', step)
+        eccodes.codes_set(gid, 'Ni', nlon)
+        eccodes.codes_set(gid, 'Nj', nlat)
+        eccodes.codes_set(gid, 'latitudeOfFirstGridPointInDegrees', south)
+        eccodes.codes_set(gid, 'latitudeOfLastGridPointInDegrees', north)
+        eccodes.codes_set(gid, 'longitudeOfFirstGridPointInDegrees', west)
+        eccodes.codes_set(gid, 'longitudeOfLastGridPointInDegrees', east)
+        eccodes.codes_set(gid, 'jScansPositively', 1)
+        eccodes.codes_set(gid, 'iDirectionIncrementInDegrees', (east - west) / (nlon - 1))
+        eccodes.codes_set(gid, 'jDirectionIncrementInDegrees', (north - south) / (nlat - 1))
+        eccodes.codes_set(gid, 'bitsPerValue', 16)
+        eccodes.codes_set_values(gid, _random(var, nlat * nlon, np.random.default_rng(seed)))
+
+        with open(path, 'wb') as f:
+            eccodes.codes_write(gid, f)
+    finally:
+        eccodes.codes_release(gid)
+
+def write_icon_files(aggregator, nlat: int = 657, nlon: int = 1377, area: tuple = (-23.5, 62.5, 29.5, 70.5)) -> int:
+    '''
+    Writes every file a configured IconAggregator with a pinned run needs into its download directory.
+    Returns the number of written files.
+    '''
+    from .download import Manifest
+
+    aggregator._select_run()
+    manifest = Manifest.of(aggregator._download_dir)
+    init = datetime.datetime.strptime(f'{aggregator._date}{aggregator._run}', '%Y%m%d%H')
+
+    count = 0
+    for var in aggregator._needed_variables:
+        for step in aggregator._steps:
+            levels = aggregator._levels if aggregator._VAR_MAPPING[var]['plev'] else [None]
+            for level in levels:
+                path = os.path.join(aggregator._download_dir, aggregator._construct_filename(step, var, level))
+                write_grib(path, var, init, step, level, nlat, nlon, area, seed=count)
+                manifest.record(path)
+                count += 1
+
+    manifest.save()
+    return count
+
+def write_content_log(path: str, aggregator, runs: list[str], size: int = 1000) -> None:
+    '''
+    Writes a stand-in for the DWD content.log.bz2, listing every file a configured
+    IconAggregator needs for each run (YYYYMMDDHH)
+    '''
+    import bz2
+
+    lines = []
+    for run in runs:
+        for url, _ in aggregator._list_needed_files(run=run):
+            path_on_server = url.split('/weather/nwp/', 1)[-1]
+            lines.append(f'./{path_on_server}|{size}|{run[:4]}-{run[4:6]}-{run[6:8]} {run[8:10]}:00')
+
+    opener = bz2.open if path.endswith('.bz2') else open
+    with opener(path, 'wt') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def dataset(nlat: int = 50, nlon: int = 60, steps: int = 9, levels: list | None = None,
+            init: datetime.datetime = datetime.datetime(2024, 1, 1),
+            area: tuple = (5.5, 15.5, 47., 55.5), variables: list | None = None, seed: int = 0) -> xr.Dataset:
+    '''
+    Dataset shaped like the output of IconAggregator, already using metchart names.
+    '''
+    if levels is None:
+        levels = [1000., 950., 900., 850., 800., 700., 600., 500., 400., 300., 200.]
+    if variables is None:
+        variables = list(_VARIABLE_RANGES)
+
+    rng = np.random.default_rng(seed)
+    west, east, south, north = area
+    init64 = np.datetime64(init, 'ns')
+
+    # NOTE like IconAggregator, time and pressure are indexed coordinates on the GRIB dimensions
+    data = {}
+    for var in variables:
+        if var in _3D:
+            dims = ('step', 'isobaricInhPa', Dimension.LATITUDE, Dimension.LONGITUDE)
+            shape = (steps, len(levels), nlat, nlon)
+        else:
+            dims = ('step', Dimension.LATITUDE, Dimension.LONGITUDE)
+            shape = (steps, nlat, nlon)
+        data[var] = xr.Variable(dims, _random(var, shape, rng), attrs={'units': _VARIABLE_RANGES[var][2]})
+
+    # NOTE the temperature has to decrease with height for sensible soundings
+    if Variable.TEMPERATURE_3D in data:
+        p = np.array(levels, dtype=float)
+        profile = 288. * (p / 1000.) ** 0.19
+        data[Variable.TEMPERATURE_3D].values[:] = profile[None, :, None, None] + rng.normal(0, 1, data[Variable.TEMPERATURE_3D].shape)
+
+    ds = xr.Dataset(data, coords={
+        Dimension.TIME: ('step', [init64 + np.timedelta64(3 * s, 'h') for s in range(steps)]),
+        Dimension.PRESSURE: ('isobaricInhPa', np.array(levels, dtype=float)),
+        Dimension.LATITUDE: (Dimension.LATITUDE, np.linspace(south, north, nlat)),
+        Dimension.LONGITUDE: (Dimension.LONGITUDE, np.linspace(west, east, nlon)),
+        Dimension.INIT_TIME: init64,
+    })
+    return ds.set_xindex(Dimension.TIME).set_xindex(Dimension.PRESSURE)
+
+def write_netcdf(path: str, **kwargs) -> xr.Dataset:
+    '''
+    Writes dataset(**kwargs) as NetCDF file, readable with an identity mapped NetCDFAggregator
+    '''
+    # NOTE NetCDF can not store indexes on other dimensions, so time and pressure become the dimensions
+    ds = dataset(**kwargs).swap_dims({'step': Dimension.TIME, 'isobaricInhPa': Dimension.PRESSURE})
+    ds.to_netcdf(path, engine='netcdf4')
+    return ds
+
+def write_wyoming_csv(path: str, levels: int = 80, seed: int = 0) -> None:
+    '''
+    Writes a sounding in the CSV format of the University of Wyoming
+    '''
+    rng = np.random.default_rng(seed)
+    p = np.linspace(1000., 100., levels)
+    height = 44330. * (1 - (p / 1013.25) ** 0.19)
+    T = 15. - 6.5 * height / 1000. + rng.normal(0, 0.5, levels)
+    Td = T - rng.uniform(0.5, 15., levels)
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['time', 'longitude', 'latitude', 'pressure_hPa', 'geopotential height_m',
+                         'temperature_C', 'dew point temperature_C', 'ice point temperature_C',
+                         'relative humidity_%', 'humidity wrt ice_%', 'mixing ratio_g/kg',
+                         'wind direction_degree', 'wind speed_m/s'])
+        for i in range(levels):
+            writer.writerow(['2024-01-01 00:00:00', 11.55, 48.25, f'{p[i]:.1f}', f'{height[i]:.0f}',
+                             f'{T[i]:.1f}', f'{Td[i]:.1f}', f'{Td[i]:.1f}',
+                             f'{rng.uniform(10, 100):.0f}', f'{rng.uniform(10, 100):.0f}',
+                             f'{rng.uniform(0.1, 8):.2f}',
+                             f'{rng.uniform(0, 360):.0f}', f'{rng.uniform(0, 60):.0f}'])
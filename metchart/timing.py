@@ -0,0 +1,106 @@
+'''
+Timing
+
+Records wall time, CPU time and processed bytes for the stages of a run.
+'''
+import os
+import json
+import time
+import threading
+import contextlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+_records = []
+_lock = threading.Lock()
+
+@contextlib.contextmanager
+def stage(name: str, record: bool = True, **tags):
+    '''
+    Times the enclosed block. The yielded dict can be used to set 'bytes'.
+    With record=False the result is not stored, e.g. when it has to be
+    returned from a worker process instead.
+    '''
+    rec = {
+        'stage': name,
+        'tags': tags,
+        'bytes': 0,
+        'pid': os.getpid(),
+        'tid': threading.get_native_id(),
+        'start': time.perf_counter(),
+    }
+    cpu = time.thread_time()
+    try:
+        yield rec
+    finally:
+        rec['cpu'] = time.thread_time() - cpu
+        rec['wall'] = time.perf_counter() - rec['start']
+        if record:
+            add(rec)
+
+def add(rec: dict) -> None:
+    with _lock:
+        _records.append(rec)
+
+def records() -> list[dict]:
+    with _lock:
+        return list(_records)
+
+def reset() -> None:
+    with _lock:
+        _records.clear()
+
+def save(filename: str) -> None:
+    with open(filename, 'w') as f:
+        f.write(json.dumps(records(), indent=4, default=str))
+
+def save_trace(filename: str) -> None:
+    '''
+    Writes all records as Trace Event Format, to be loaded into
+    chrome://tracing or https://ui.perfetto.dev
+    '''
+    recs = records()
+    origin = min([r['start'] for r in recs], default=0)
+
+    events = []
+    for pid in sorted(set([r['pid'] for r in recs])):
+        events.append({
+            'name': 'process_name', 'ph': 'M', 'pid': pid,
+            'args': {'name': 'metchart' if pid == os.getpid() else f'worker {pid}'}
+        })
+
+    for r in recs:
+        label = [str(v) for k, v in r['tags'].items() if k in ('aggregator', 'variable', 'file', 'plotter', 'view')]
+        events.append({
+            'name': ' '.join([r['stage']] + label),
+            'cat': r['stage'],
+            'ph': 'X',
+            'ts': (r['start'] - origin) * 1e6,
+            'dur': r['wall'] * 1e6,
+            'pid': r['pid'],
+            'tid': r['tid'],
+            'args': r['tags'] | {'bytes': r['bytes'], 'cpu': r['cpu']},
+        })
+
+    with open(filename, 'w') as f:
+        f.write(json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, default=str))
+
+def summary() -> str:
+    stats = {}
+    for rec in records():
+        s = stats.setdefault(rec['stage'], {'count': 0, 'wall': 0., 'max': 0., 'cpu': 0., 'bytes': 0})
+        s['count'] += 1
+        s['wall'] += rec['wall']
+        s['max'] = max(s['max'], rec['wall'])
+        s['cpu'] += rec['cpu']
+        s['bytes'] += rec['bytes']
+
+    lines = ['{:<12} {:>6} {:>10} {:>10} {:>10} {:>12} {:>10}'.format(
+        'stage', 'count', 'wall [s]', 'max [s]', 'cpu [s]', 'bytes [MB]', 'MB/s')]
+    for name, s in stats.items():
+        mb = s['bytes'] / 1e6
+        lines.append('{:<12} {:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>12.1f} {:>10.1f}'.format(
+            name, s['count'], s['wall'], s['max'], s['cpu'], mb, mb / s['wall'] if s['wall'] > 0 else 0))
+
+    return '\n'.join(lines)
@@ -0,0 +1,89 @@
+import os
+import threading
+import multiprocessing
+
+from metchart import cache
+
+RUNS = ['2024010100', '2024010106', '2024010112']
+
+def _run_of(filename: str) -> str | None:
+    return filename.split('_')[1]
+
+def _write_runs(cache_dir, directory: str = 'icon-eu') -> str:
+    '''
+    Two files per run, older runs were used longer ago
+    '''
+    path = cache_dir / directory
+    path.mkdir()
+    for i, run in enumerate(RUNS):
+        for name in ('t', 'u'):
+            f = path / f'{name}_{run}_000.grib2'
+            f.write_bytes(b'x' * 100)
+            os.utime(f, (1000 + i, 1000 + i))
+    return str(path)
+
+def _runs(path: str) -> set:
+    return set([_run_of(f) for f in os.listdir(path) if f.endswith('.grib2')])
+
+def test_keeps_newest_run(tmp_path):
+    path = _write_runs(tmp_path)
+
+    freed = cache.Cache(str(tmp_path), max_runs=1).clean({'icon-eu': _run_of})
+    assert freed == 4 * 100
+    assert _runs(path) == set(RUNS[-1:])
+
+    # NOTE even if it exceeds the limit on its own
+    cache.Cache(str(tmp_path), max_bytes=1).clean({'icon-eu': _run_of})
+    assert _runs(path) == set(RUNS[-1:])
+
+def test_keeps_protected_runs(tmp_path):
+    path = _write_runs(tmp_path)
+
+    cache.Cache(str(tmp_path), max_runs=1).clean({'icon-eu': _run_of}, protected={('icon-eu', RUNS[0])})
+    assert _runs(path) == set([RUNS[0], RUNS[-1]])
+
+def test_skips_locked_runs(tmp_path):
+    path = _write_runs(tmp_path)
+
+    locked, release = threading.Event(), threading.Event()
+    def hold():
+        with cache.lock(path, int(RUNS[0])):
+            locked.set()
+            release.wait()
+    holder = threading.Thread(target=hold)
+    holder.start()
+    locked.wait()
+    try:
+        cache.Cache(str(tmp_path), max_runs=1).clean({'icon-eu': _run_of})
+    finally:
+        release.set()
+        holder.join()
+    assert _runs(path) == set([RUNS[0], RUNS[-1]])
+
+def _hold(path: str, key: int, locked, release) -> None:
+    with cache.lock(path, key):
+        locked.set()
+        release.wait()
+
+def test_skips_runs_locked_by_other_processes(tmp_path):
+    path = _write_runs(tmp_path)
+
+    ctx = multiprocessing.get_context('spawn')
+    locked, release = ctx.Event(), ctx.Event()
+    holder = ctx.Process(target=_hold, args=(path, int(RUNS[1]), locked, release))
+    holder.start()
+    assert locked.wait(60)
+    try:
+        cache.Cache(str(tmp_path), max_runs=1).clean({'icon-eu': _run_of})
+    finally:
+        release.set()
+        holder.join()
+    assert _runs(path) == set(RUNS[1:])
+
+def test_lock_without_blocking(tmp_path):
+    with cache.lock(str(tmp_path), 1) as held:
+        assert held
+        with cache.lock(str(tmp_path), 1, blocking=False) as again:
+            assert not again
+        with cache.lock(str(tmp_path), 2, blocking=False) as other:
+            assert other
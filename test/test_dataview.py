@@ -0,0 +1,50 @@
+import yaml
+
+from metchart import synthetic
+from metchart.aggregator import DataView
+from metchart.manager import Manager
+
+POINTS = [
+    {'name': 'muc', 'query': {'latitude': 48.16, 'longitude': 11.57, 'method': 'nearest'}},
+    {'name': 'ber', 'query': {'latitude': 52.5, 'longitude': 13.4, 'method': 'nearest'}},
+]
+
+def test_positional_selection_matches_labels():
+    ds = synthetic.dataset(nlat=20, nlon=30, steps=3, levels=[1000., 850., 500.])
+
+    for point_view, query in zip(DataView(ds, name='x').for_queries(POINTS), POINTS):
+        assert point_view._positions is not None
+        point = ds.sel(**query['query'])
+        assert point_view.get().identical(point)
+
+        for view in point_view.along_dimensions(['time', 'pressure']):
+            assert view._positions is not None
+            assert view.get().identical(point.sel(**view.query))
+
+    for view in DataView(ds, name='x').along_dimensions(['time']):
+        assert view.get().identical(ds.sel(**view.query))
+
+def test_no_dimensions():
+    ds = synthetic.dataset(nlat=20, nlon=30, steps=3)
+    assert [v.name for v in DataView(ds, name='x').along_dimensions([])] == ['x']
+
+def test_plan_with_queries(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = {
+        'output': str(tmp_path / 'output'),
+        'thread_count': 1,
+        'aggregator': {'icon_eu': {
+            'module': 'dwd_icon', 'model': 'icon-eu', 'run': '2024010100',
+            'pressure_levels': [1000, 850], 'steps': [0, 3],
+        }},
+        'plotter': {'skewt': {
+            'module': 'skewt', 'aggregator': 'icon_eu',
+            'along_dimensions': ['time'], 'for_queries': POINTS,
+        }},
+    }
+    (tmp_path / 'config.yaml').write_text(yaml.safe_dump(config))
+
+    # NOTE plan datasets only hold coordinates, without latitude and longitude
+    plan = Manager(str(tmp_path / 'config.yaml')).plan()
+    assert plan['plotters']['skewt']['views'] == 4
+    assert plan['aggregators']['icon_eu']['files'] > 0
@@ -0,0 +1,101 @@
+import os
+import bz2
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from metchart import synthetic
+from metchart.aggregator import Variable
+from metchart.aggregator.dwd_icon import IconAggregator
+from metchart.download import Downloader, Manifest, PART_SUFFIX
+
+DATA = bz2.compress(os.urandom(1 << 17))
+
+class _Handler(BaseHTTPRequestHandler):
+    '''
+    Serves the current body of the server with ETag and Range support
+    '''
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        body, etag = self.server.body, self.server.etag
+
+        start = 0
+        if 'Range' in self.headers and self.headers.get('If-Range') == etag:
+            start = int(self.headers['Range'].removeprefix('bytes=').split('-')[0])
+        self.send_response(206 if start > 0 else 200)
+        if start > 0:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.body, httpd.etag, httpd.requests = DATA, '"v1"', []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def _url(server) -> str:
+    return f'http://127.0.0.1:{server.server_address[1]}/file.grib2.bz2'
+
+def _interrupted(server, dest: str, received: int) -> None:
+    '''
+    State left by a transfer that broke off after received bytes
+    '''
+    with open(dest + PART_SUFFIX, 'wb') as f:
+        f.write(server.body[:received])
+    Manifest.of(os.path.dirname(dest)).set(os.path.basename(dest), {'complete': False, 'url': _url(server), 'etag': '"v1"'})
+
+def test_download(tmp_path, server):
+    dest = str(tmp_path / 'file.grib2')
+    assert Downloader().download_all([(_url(server), dest)], decompress='bz2') == []
+
+    assert open(dest, 'rb').read() == bz2.decompress(DATA)
+    assert Manifest.of(str(tmp_path)).is_complete(dest, verify=True)
+    assert not os.path.exists(dest + PART_SUFFIX)
+
+    # NOTE complete files are not fetched again
+    Downloader().download_all([(_url(server), dest)], decompress='bz2')
+    assert len(server.requests) == 1
+
+def test_resume_truncated_part(tmp_path, server):
+    dest = str(tmp_path / 'file.grib2')
+    _interrupted(server, dest, 1000)
+
+    received = Downloader().download(_url(server), dest, decompress='bz2')
+
+    assert server.requests[-1]['Range'] == 'bytes=1000-'
+    assert received == len(DATA) - 1000
+    assert open(dest, 'rb').read() == bz2.decompress(DATA)
+    assert Manifest.of(str(tmp_path)).is_complete(dest, verify=True)
+
+def test_resume_changed_file(tmp_path, server):
+    dest = str(tmp_path / 'file.grib2')
+    _interrupted(server, dest, 1000)
+    # NOTE If-Range does not match, so the whole new file is sent
+    server.body, server.etag = bz2.compress(b'changed'), '"v2"'
+
+    received = Downloader().download(_url(server), dest, decompress='bz2')
+
+    assert received == len(server.body)
+    assert open(dest, 'rb').read() == b'changed'
+    assert Manifest.of(str(tmp_path)).get('file.grib2')['etag'] == '"v2"'
+
+def test_synthetic_files_in_shared_manifest(tmp_path):
+    agg = IconAggregator(str(tmp_path), 'icon_eu')
+    agg.load_config(model='icon-eu', pressure_levels=[1000], steps=[0], run='2024010100')
+    agg.add_needed(Variable.TEMPERATURE_3D)
+    # NOTE already in use, like by the downloader of an aggregator
+    Manifest.of(agg._download_dir)
+
+    synthetic.write_icon_files(agg, nlat=3, nlon=4)
+    assert all([agg._downloader.is_complete(dest) for _, dest in agg._list_needed_files()])
@@ -0,0 +1,103 @@
+import os
+import datetime
+
+import numpy as np
+import xarray as xr
+
+import pytest
+
+from metchart import synthetic
+from metchart.aggregator import Variable, AggregatorException
+from metchart.aggregator import dwd_icon
+from metchart.aggregator.dwd_icon import IconAggregator
+
+def _aggregator(cache_dir, **kwargs) -> IconAggregator:
+    agg = IconAggregator(str(cache_dir), 'icon_eu')
+    agg.load_config(**({'model': 'icon-eu', 'pressure_levels': [1000, 850], 'steps': [0, 3]} | kwargs))
+    agg.add_needed(Variable.TEMPERATURE_3D)
+    agg.add_needed(Variable.TEMPERATURE_SURFACE)
+    return agg
+
+@pytest.fixture
+def offline(monkeypatch):
+    '''
+    Downloads of the listing, which fail
+    '''
+    calls = []
+    def fail(url, *args, **kwargs):
+        calls.append(url)
+        raise OSError('offline')
+    monkeypatch.setattr(dwd_icon._listing_downloader, 'download', fail)
+    return calls
+
+def test_plan_without_listing(tmp_path, offline):
+    agg = _aggregator(tmp_path)
+    plan = agg.plan()
+
+    assert (agg._run, agg._date) == dwd_icon.get_current_run()
+    assert len(plan['files']) == 2 * 2 + 2
+    assert offline == []
+
+def test_plan_with_cached_listing(tmp_path, offline):
+    agg = _aggregator(tmp_path, run='2024010112')
+    synthetic.write_content_log(str(tmp_path / os.path.basename(dwd_icon.CONTENT_LOG)), agg, ['2024010100', '2024010106'])
+
+    agg = _aggregator(tmp_path)
+    agg.plan()
+    assert agg._date + agg._run == '2024010106'
+    assert offline == []
+
+def test_runs_in_use(tmp_path):
+    agg = _aggregator(tmp_path, run='2024010106')
+    assert agg.runs_in_use() == []
+
+    # NOTE data of an earlier run is held, e.g. if aggregating the selected one failed
+    agg._select_run()
+    agg._dataset = synthetic.dataset(nlat=2, nlon=2, steps=1, init=datetime.datetime(2024, 1, 1))
+    assert set(agg.runs_in_use()) == {'2024010106', '2024010100'}
+
+def test_latest_complete_run(tmp_path):
+    listing = str(tmp_path / 'content.log')
+    synthetic.write_content_log(listing, _aggregator(tmp_path / 'a'), ['2024010100', '2024010106'])
+    # NOTE the newest run is still being published, only its first step is listed
+    synthetic.write_content_log(str(tmp_path / 'partial.log'), _aggregator(tmp_path / 'b', steps=[0]), ['2024010112'])
+    with open(listing, 'a') as f, open(tmp_path / 'partial.log') as partial:
+        f.write(partial.read())
+
+    agg = _aggregator(tmp_path / 'c', listing=listing)
+    agg._select_run()
+    assert agg._date + agg._run == '2024010106'
+
+    agg = _aggregator(tmp_path / 'd', listing=listing, incremental=True)
+    agg._select_run()
+    assert agg._date + agg._run == '2024010112'
+
+def test_no_complete_run(tmp_path):
+    listing = str(tmp_path / 'content.log')
+    synthetic.write_content_log(listing, _aggregator(tmp_path / 'a', steps=[0]), ['2024010100', '2024010106'])
+
+    agg = _aggregator(tmp_path / 'b', listing=listing)
+    with pytest.raises(AggregatorException):
+        agg._select_run()
+    # NOTE no probed run is left selected
+    assert agg._run is None and agg._date is None
+    assert agg.fingerprint() is None
+
+def test_pack_missing_values(tmp_path):
+    ds = synthetic.dataset(nlat=3, nlon=4, steps=2, levels=[1000.], variables=[Variable.TEMPERATURE_SURFACE, Variable.HUMIDITY_SURFACE])
+    ds = ds.astype('float32')
+    ds[Variable.HUMIDITY_SURFACE][:] = np.nan
+    ds[Variable.TEMPERATURE_SURFACE][0, 0, 0] = np.nan
+
+    assert dwd_icon._pack_encoding(ds[Variable.HUMIDITY_SURFACE]) == {}
+    path = str(tmp_path / 'store.nc')
+    dwd_icon._write_store(ds, path, pack=True)
+
+    stored = xr.open_dataset(path)
+    assert stored[Variable.TEMPERATURE_SURFACE].encoding['dtype'] == np.int16
+    assert np.isnan(stored[Variable.TEMPERATURE_SURFACE].values[0, 0, 0])
+    np.testing.assert_allclose(stored[Variable.TEMPERATURE_SURFACE].values, ds[Variable.TEMPERATURE_SURFACE].values, atol=0.01)
+    # NOTE stored as it is
+    assert stored[Variable.HUMIDITY_SURFACE].encoding['dtype'] == np.float32
+    assert np.isnan(stored[Variable.HUMIDITY_SURFACE].values).all()
+    stored.close()
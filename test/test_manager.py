@@ -0,0 +1,169 @@
+import os
+import json
+
+import yaml
+
+from metchart import synthetic
+from metchart import manager as manager_module
+from metchart.aggregator import Variable, dwd_icon
+from metchart.manager import Manager
+
+def _manager(tmp_path, monkeypatch, **config) -> Manager:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'config.yaml').write_text(yaml.safe_dump({'output': str(tmp_path / 'output'), 'thread_count': 1} | config))
+    return Manager(str(tmp_path / 'config.yaml'))
+
+def _netcdf_config(path: str) -> dict:
+    return {
+        'aggregator': {'file': {
+            'module': 'netcdf', 'files': [path],
+            'variable_map': {'temperature_surface': 'temperature_surface'},
+            'dimension_map': {d: d for d in ['time', 'pressure', 'latitude', 'longitude']},
+        }},
+        'plotter': {'debug': {
+            'module': 'debug', 'aggregator': 'file',
+            'config': {'needed': ['temperature_surface']},
+            'along_dimensions': ['time'],
+        }},
+    }
+
+def _indexed(tmp_path) -> list:
+    '''
+    Entries of the debug plotter in the index
+    '''
+    with open(tmp_path / 'output' / 'index.json') as f:
+        if 'debug' not in [sub['name'] for sub in json.load(f)]:
+            return []
+    with open(tmp_path / 'output' / 'debug.index.json') as f:
+        return json.load(f)
+
+def test_failed_aggregation_keeps_plots(tmp_path, monkeypatch):
+    path = str(tmp_path / 'data.nc')
+    synthetic.write_netcdf(path, nlat=5, nlon=6, steps=3)
+    manager = _manager(tmp_path, monkeypatch, **_netcdf_config(path))
+
+    assert manager.run() == ['file']
+    assert len(_indexed(tmp_path)) == 3
+
+    # NOTE the data aggregated before is still held and plotted
+    os.unlink(path)
+    assert manager.run(aggregators=['file']) == []
+    assert len(_indexed(tmp_path)) == 3
+
+def test_cache_cleaned_after_rendering(tmp_path, monkeypatch):
+    path = str(tmp_path / 'data.nc')
+    synthetic.write_netcdf(path, nlat=5, nlon=6, steps=3)
+    manager = _manager(tmp_path, monkeypatch, **_netcdf_config(path))
+
+    calls = []
+    finish = manager._finish_plot_jobs
+    monkeypatch.setattr(manager, '_finish_plot_jobs', lambda *args: calls.append('plot') or finish(*args))
+    monkeypatch.setattr(manager, 'clean_cache', lambda: calls.append('clean'))
+    manager.run()
+    assert calls == ['plot', 'clean']
+
+def test_failed_view_does_not_abort_run(tmp_path, monkeypatch):
+    path = str(tmp_path / 'data.nc')
+    synthetic.write_netcdf(path, nlat=5, nlon=6, steps=3)
+    config = _netcdf_config(path)
+    # NOTE without method, the point is not on the grid and can not be selected
+    config['plotter'] = {
+        'missing': config['plotter']['debug'] | {'for_queries': [
+            {'name': 'off_grid', 'query': {'latitude': 50.001, 'longitude': 10.001}},
+        ]},
+    } | config['plotter']
+    manager = _manager(tmp_path, monkeypatch, **config)
+
+    assert manager.run() == ['file']
+    assert len(_indexed(tmp_path)) == 3
+
+def _rendered(monkeypatch) -> list:
+    '''
+    Names of the views rendered from now on
+    '''
+    rendered = []
+    plot_job = manager_module._plot_job
+    def record(plotter, view):
+        rendered.append(view.generate_unique_name())
+        return plot_job(plotter, view)
+    monkeypatch.setattr(manager_module, '_plot_job', record)
+    return rendered
+
+def test_changed_data_rendered_again(tmp_path, monkeypatch):
+    import matplotlib
+    matplotlib.use('agg')
+
+    path = str(tmp_path / 'data.nc')
+    synthetic.write_netcdf(path, nlat=5, nlon=6, steps=2, levels=[1000., 850.])
+    config = _netcdf_config(path)
+    config['aggregator']['file']['variable_map']['temperature_3d'] = 'temperature_3d'
+    config['plotter']['g'] = {
+        'module': 'graph', 'aggregator': 'file',
+        'config': {'x_dim': 'pressure', 'vars': ['temperature_3d']},
+        'along_dimensions': ['time'],
+        'for_queries': [{'name': 'muc', 'query': {'latitude': 48.16, 'longitude': 11.57, 'method': 'nearest'}}],
+    }
+    manager = _manager(tmp_path, monkeypatch, **config)
+    rendered = _rendered(monkeypatch)
+    graphs = ['g_muc_time-2024-01-01-0000UTC', 'g_muc_time-2024-01-01-0300UTC']
+
+    manager.run()
+    assert sorted([v for v in rendered if v.startswith('g_')]) == graphs
+
+    # NOTE the debug plotter writes no file, it is not taken from the cache
+    rendered.clear()
+    manager.run()
+    assert rendered == ['debug_time-2024-01-01-0000UTC', 'debug_time-2024-01-01-0300UTC']
+
+    # NOTE replaced, the aggregator still holds the old file open
+    synthetic.write_netcdf(path + '.new', nlat=5, nlon=6, steps=2, levels=[1000., 850.], seed=1)
+    os.replace(path + '.new', path)
+    rendered.clear()
+    manager.run()
+    assert sorted([v for v in rendered if v.startswith('g_')]) == graphs
+    assert len(rendered) == 4
+
+def test_failed_run_does_not_take_over_plots(tmp_path, monkeypatch):
+    import matplotlib
+    matplotlib.use('agg')
+
+    listing = str(tmp_path / 'content.log')
+    icon = {'module': 'dwd_icon', 'model': 'icon-eu', 'pressure_levels': [1000, 850], 'steps': [0, 6],
+            'listing': listing, 'decode_workers': 1, 'download_retries': 0}
+    # NOTE nothing listens there, the files of a run not written below can not be downloaded
+    monkeypatch.setattr(dwd_icon, 'BASE', 'http://127.0.0.1:9')
+    manager = _manager(tmp_path, monkeypatch, **{
+        'aggregator': {'icon_eu': icon},
+        'plotter': {'g': {
+            'module': 'graph', 'aggregator': 'icon_eu',
+            'config': {'x_dim': 'pressure', 'vars': ['temperature_3d']},
+            'along_dimensions': ['time'],
+            'for_queries': [{'name': 'muc', 'query': {'latitude': 48.16, 'longitude': 11.57, 'method': 'nearest'}}],
+        }},
+    })
+    rendered = _rendered(monkeypatch)
+
+    def publish(runs: list[str]) -> None:
+        writer = dwd_icon.IconAggregator(str(tmp_path / 'metchart_cache'), 'writer')
+        writer.load_config(**{k: v for k, v in icon.items() if k != 'module'} | {'run': runs[-1]})
+        writer.add_needed(Variable.TEMPERATURE_3D)
+        synthetic.write_content_log(listing, writer, runs)
+        synthetic.write_icon_files(writer, nlat=10, nlon=10, area=(5.5, 15.5, 47., 55.5))
+
+    publish(['2024010100'])
+    assert manager.run() == ['icon_eu']
+    assert rendered == ['g_muc_time-2024-01-01-0000UTC', 'g_muc_time-2024-01-01-0600UTC']
+
+    # NOTE run 06 is listed, but its files can not be fetched. The data of run 00 is plotted
+    writer = dwd_icon.IconAggregator(str(tmp_path / 'metchart_cache'), 'writer')
+    writer.load_config(**{k: v for k, v in icon.items() if k != 'module'})
+    writer.add_needed(Variable.TEMPERATURE_3D)
+    synthetic.write_content_log(listing, writer, ['2024010100', '2024010106'])
+    rendered.clear()
+    assert manager.run(aggregators=['icon_eu']) == []
+    assert rendered == []
+
+    publish(['2024010100', '2024010106'])
+    rendered.clear()
+    assert manager.run(aggregators=['icon_eu']) == ['icon_eu']
+    assert rendered == ['g_muc_time-2024-01-01-0600UTC', 'g_muc_time-2024-01-01-1200UTC']